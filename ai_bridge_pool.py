@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+🌉 AI BRIDGE POOL - МНОГОПРОЦЕССНЫЙ МОСТ ДЛЯ МНОЖЕСТВА ПАР ЧАТОВ 🌉
+Пул процессов для Selenium/CDP моста (развитие ai_bridge_v0.3.py из bridge.sh)
+
+Находит все пары вкладок Gemini/Claude в отладочном сеансе Chrome,
+распределяет их между рабочими процессами (у каждого своё соединение
+с драйвером) и следит за ними: упавший или зависший процесс
+перезапускается, а статистика собирается в родительском процессе.
+
+Запуск: python3 ai_bridge_pool.py --workers 8
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing as mp
+import os
+import queue
+import signal
+import sys
+import time
+from pathlib import Path
+
+# --- CSS селекторы (как в ai_bridge_v0.3.py) ---
+GEMINI_URL_PART = "gemini.google.com"
+CLAUDE_URL_PART = "claude.ai"
+GEMINI_INPUT_BOX = "div.input-area"
+GEMINI_RESPONSE_CONTAINER = "div.response-container"
+CLAUDE_INPUT_BOX = 'div[contenteditable="true"]'
+CLAUDE_SEND_BUTTON = 'button[aria-label="Send Message"]'
+CLAUDE_RESPONSE_CONTAINER = "div.font-claude-message"
+
+DEBUGGER_ADDRESS = "127.0.0.1:9222"
+POOL_STATS_FILE = Path("bridge_pool_stats.json")
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s [%(levelname)s] %(processName)s: %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def connect_driver(debugger_address, command_timeout):
+    """Отдельное подключение к существующему сеансу Chrome"""
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+
+    chrome_options = Options()
+    chrome_options.add_experimental_option("debuggerAddress", debugger_address)
+    driver = webdriver.Chrome(options=chrome_options)
+    # Ограничиваем время одной команды, чтобы вкладка не вешала процесс навсегда
+    driver.set_page_load_timeout(command_timeout)
+    driver.set_script_timeout(command_timeout)
+    return driver
+
+
+def find_chat_pairs(driver):
+    """Все пары вкладок (gemini_handle, claude_handle) в порядке открытия"""
+    gemini_handles, claude_handles = [], []
+    for handle in driver.window_handles:
+        driver.switch_to.window(handle)
+        if GEMINI_URL_PART in driver.current_url:
+            gemini_handles.append(handle)
+        elif CLAUDE_URL_PART in driver.current_url:
+            claude_handles.append(handle)
+    return list(zip(gemini_handles, claude_handles))
+
+
+def shard_pairs(pairs, workers):
+    """Раскладка пар по процессам (по кругу, чтобы нагрузка была ровной)"""
+    shards = [[] for _ in range(workers)]
+    for index, pair in enumerate(pairs):
+        shards[index % workers].append(pair)
+    return [shard for shard in shards if shard]
+
+
+def get_latest_message_text(driver, container_selector):
+    from selenium.common.exceptions import NoSuchElementException, TimeoutException
+
+    try:
+        responses = driver.find_elements("css selector", container_selector)
+        return responses[-1].text if responses else None
+    except (NoSuchElementException, TimeoutException):
+        return None
+
+
+def send_message(driver, input_selector, message, wait_timeout, button_selector=None):
+    from selenium.webdriver.common.keys import Keys
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    input_box = WebDriverWait(driver, wait_timeout).until(
+        EC.presence_of_element_located(("css selector", input_selector)))
+    input_box.clear()
+    input_box.send_keys(message)
+    if button_selector:
+        send_button = WebDriverWait(driver, wait_timeout).until(
+            EC.element_to_be_clickable(("css selector", button_selector)))
+        send_button.click()
+    else:
+        input_box.send_keys(Keys.RETURN)
+
+
+def worker_main(worker_id, pairs, events, options):
+    """Рабочий процесс: свой драйвер и свой набор пар вкладок"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Останавливает только родитель
+    # Обработчик SIGTERM родителя унаследован при fork - terminate() должен убивать
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    try:
+        driver = connect_driver(options["debugger_address"], options["command_timeout"])
+    except Exception as e:
+        events.put(("error", worker_id, None, f"connect: {e}"))
+        sys.exit(1)
+
+    last_messages = {}
+    for gemini_tab, claude_tab in pairs:
+        driver.switch_to.window(gemini_tab)
+        last_messages[gemini_tab] = get_latest_message_text(driver, GEMINI_RESPONSE_CONTAINER)
+        driver.switch_to.window(claude_tab)
+        last_messages[claude_tab] = get_latest_message_text(driver, CLAUDE_RESPONSE_CONTAINER)
+
+    events.put(("started", worker_id, None, len(pairs)))
+
+    while True:
+        for gemini_tab, claude_tab in pairs:
+            pair_id = f"{gemini_tab[-8:]}/{claude_tab[-8:]}"
+            try:
+                driver.switch_to.window(gemini_tab)
+                current = get_latest_message_text(driver, GEMINI_RESPONSE_CONTAINER)
+                if current and current != last_messages[gemini_tab]:
+                    driver.switch_to.window(claude_tab)
+                    send_message(driver, CLAUDE_INPUT_BOX, current,
+                                 options["wait_timeout"], CLAUDE_SEND_BUTTON)
+                    last_messages[gemini_tab] = current
+                    events.put(("relayed", worker_id, pair_id, "gemini->claude"))
+
+                driver.switch_to.window(claude_tab)
+                current = get_latest_message_text(driver, CLAUDE_RESPONSE_CONTAINER)
+                if current and current != last_messages[claude_tab]:
+                    driver.switch_to.window(gemini_tab)
+                    send_message(driver, GEMINI_INPUT_BOX, current, options["wait_timeout"])
+                    last_messages[claude_tab] = current
+                    events.put(("relayed", worker_id, pair_id, "claude->gemini"))
+            except Exception as e:
+                events.put(("error", worker_id, pair_id, str(e)))
+                if gemini_tab not in driver.window_handles or claude_tab not in driver.window_handles:
+                    # Вкладка закрыта - пусть родитель заново найдёт пары
+                    events.put(("pair_lost", worker_id, pair_id, None))
+                    sys.exit(2)
+
+        events.put(("heartbeat", worker_id, None, time.time()))
+        time.sleep(options["poll_interval"])
+
+
+class WorkerSlot:
+    """Состояние одного рабочего процесса под надзором родителя"""
+
+    def __init__(self, worker_id, pairs):
+        self.worker_id = worker_id
+        self.pairs = pairs
+        self.process = None
+        self.last_heartbeat = 0.0
+        self.restarts = 0
+        self.next_start = 0.0
+        self.relayed = 0
+        self.errors = 0
+
+
+class BridgePool:
+    """Родительский процесс: шардинг пар, перезапуски и общая статистика"""
+
+    def __init__(self, options):
+        self.options = options
+        self.events = mp.Queue()
+        self.slots = []
+        self.pairs = []
+        self.running = False
+        self.pool_stats = {
+            "messages_relayed": 0,
+            "errors": 0,
+            "restarts": 0,
+            "reshards": 0,
+            "start_time": time.time()
+        }
+
+    def discover(self):
+        """Поиск пар вкладок через отдельное подключение родителя"""
+        driver = connect_driver(self.options["debugger_address"], self.options["command_timeout"])
+        try:
+            return find_chat_pairs(driver)
+        finally:
+            # quit() закрыл бы сам Chrome, поэтому просто отпускаем сессию
+            driver.service.stop()
+
+    def reshard(self, pairs):
+        """Пересоздание процессов под новый набор пар"""
+        self.stop_workers()
+        self.pairs = pairs
+        self.slots = [
+            WorkerSlot(worker_id, shard)
+            for worker_id, shard in enumerate(shard_pairs(pairs, self.options["workers"]))
+        ]
+        self.pool_stats["reshards"] += 1
+        logger.info(f"🔀 {len(pairs)} пар распределено по {len(self.slots)} процессам")
+
+    def start_worker(self, slot):
+        slot.process = mp.Process(
+            target=worker_main,
+            args=(slot.worker_id, slot.pairs, self.events, self.options),
+            name=f"bridge-worker-{slot.worker_id}",
+            daemon=True
+        )
+        slot.process.start()
+        # Даём процессу время подключиться, прежде чем считать его зависшим
+        slot.last_heartbeat = time.time() + self.options["command_timeout"]
+
+    def schedule_restart(self, slot, reason):
+        slot.restarts += 1
+        self.pool_stats["restarts"] += 1
+        backoff = min(self.options["max_backoff"], 2 ** min(slot.restarts, 6))
+        slot.next_start = time.time() + backoff
+        slot.process = None
+        logger.warning(f"♻️ Процесс #{slot.worker_id} ({reason}), перезапуск через {backoff}с")
+
+    def drain_events(self):
+        """Сбор событий от рабочих процессов"""
+        needs_rediscovery = False
+        while True:
+            try:
+                kind, worker_id, pair_id, payload = self.events.get_nowait()
+            except queue.Empty:
+                break
+            slot = next((s for s in self.slots if s.worker_id == worker_id), None)
+            if slot is None:
+                continue
+            slot.last_heartbeat = max(slot.last_heartbeat, time.time())
+            if kind == "relayed":
+                slot.relayed += 1
+                self.pool_stats["messages_relayed"] += 1
+                logger.info(f"🗣️ #{worker_id} [{pair_id}] {payload}")
+            elif kind == "error":
+                slot.errors += 1
+                self.pool_stats["errors"] += 1
+                logger.error(f"❌ #{worker_id} [{pair_id}] {payload}")
+            elif kind == "pair_lost":
+                needs_rediscovery = True
+            elif kind == "started":
+                logger.info(f"✅ Процесс #{worker_id} ведёт {payload} пар")
+        return needs_rediscovery
+
+    def supervise(self):
+        """Проверка живости процессов и перезапуск упавших/зависших"""
+        now = time.time()
+        for slot in self.slots:
+            if slot.process is None:
+                if now >= slot.next_start:
+                    self.start_worker(slot)
+                continue
+            if not slot.process.is_alive():
+                self.schedule_restart(slot, f"код выхода {slot.process.exitcode}")
+            elif now - slot.last_heartbeat > self.options["hang_timeout"]:
+                # Зависший WebDriverWait блокирует только этот процесс
+                slot.process.terminate()
+                slot.process.join(5)
+                if slot.process.is_alive():
+                    slot.process.kill()
+                    slot.process.join()
+                self.schedule_restart(slot, "завис")
+
+    def stats_snapshot(self):
+        return {
+            "timestamp": time.time(),
+            "uptime": time.time() - self.pool_stats["start_time"],
+            "pairs": len(self.pairs),
+            "pool_stats": self.pool_stats,
+            "workers": [
+                {
+                    "worker_id": slot.worker_id,
+                    "pairs": len(slot.pairs),
+                    "alive": bool(slot.process and slot.process.is_alive()),
+                    "relayed": slot.relayed,
+                    "errors": slot.errors,
+                    "restarts": slot.restarts
+                }
+                for slot in self.slots
+            ]
+        }
+
+    def save_stats(self):
+        try:
+            POOL_STATS_FILE.write_text(
+                json.dumps(self.stats_snapshot(), indent=2, ensure_ascii=False),
+                encoding="utf-8"
+            )
+        except OSError as e:
+            logger.error(f"❌ Ошибка сохранения статистики: {e}")
+
+    def stop_workers(self):
+        for slot in self.slots:
+            if slot.process is not None and slot.process.is_alive():
+                slot.process.terminate()
+        for slot in self.slots:
+            if slot.process is not None:
+                slot.process.join(5)
+                if slot.process.is_alive():
+                    logger.warning(f"🔪 Рабочий процесс {slot.process.pid} не завершился, SIGKILL")
+                    slot.process.kill()
+                    slot.process.join()
+
+    def run(self):
+        pairs = self.discover()
+        if not pairs:
+            logger.error("❌ Не найдено ни одной пары вкладок Gemini и Claude.")
+            return 1
+        self.reshard(pairs)
+        self.running = True
+
+        last_discovery = last_stats = time.time()
+        try:
+            while self.running:
+                needs_rediscovery = self.drain_events()
+                self.supervise()
+
+                now = time.time()
+                if needs_rediscovery or now - last_discovery >= self.options["rediscover_interval"]:
+                    last_discovery = now
+                    try:
+                        pairs = self.discover()
+                    except Exception as e:
+                        logger.error(f"❌ Ошибка поиска вкладок: {e}")
+                    else:
+                        if pairs != self.pairs:
+                            self.reshard(pairs)
+
+                if now - last_stats >= self.options["stats_interval"]:
+                    last_stats = now
+                    self.save_stats()
+                    logger.info(
+                        f"📊 Пар: {len(self.pairs)}, передано: {self.pool_stats['messages_relayed']}, "
+                        f"ошибок: {self.pool_stats['errors']}, перезапусков: {self.pool_stats['restarts']}"
+                    )
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            logger.info("⏹️ Получен сигнал остановки")
+        finally:
+            self.stop_workers()
+            self.save_stats()
+        return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Многопроцессный мост Gemini <-> Claude")
+    parser.add_argument("--debugger-address", default=DEBUGGER_ADDRESS)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--poll-interval", type=float, default=3.0)
+    parser.add_argument("--wait-timeout", type=float, default=10.0,
+                        help="таймаут WebDriverWait при отправке")
+    parser.add_argument("--command-timeout", type=float, default=30.0,
+                        help="таймаут одной команды драйвера")
+    parser.add_argument("--hang-timeout", type=float, default=120.0,
+                        help="через сколько секунд без heartbeat процесс считается зависшим")
+    parser.add_argument("--max-backoff", type=float, default=60.0)
+    parser.add_argument("--rediscover-interval", type=float, default=60.0)
+    parser.add_argument("--stats-interval", type=float, default=30.0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    options = {
+        "debugger_address": args.debugger_address,
+        "workers": max(1, args.workers),
+        "poll_interval": args.poll_interval,
+        "wait_timeout": args.wait_timeout,
+        "command_timeout": args.command_timeout,
+        "hang_timeout": args.hang_timeout,
+        "max_backoff": args.max_backoff,
+        "rediscover_interval": args.rediscover_interval,
+        "stats_interval": args.stats_interval
+    }
+
+    pool = BridgePool(options)
+    signal.signal(signal.SIGTERM, lambda signum, frame: setattr(pool, "running", False))
+
+    try:
+        return pool.run()
+    except Exception as e:
+        logger.error(f"❌ Ошибка подключения: {e}")
+        logger.error("Убедитесь, что Chrome запущен с флагом --remote-debugging-port")
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
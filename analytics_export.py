@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+📊 ANALYTICS EXPORT - выгрузка диалогов и бэкапов в SQLite
+Журналы моста (bridge_dialog_emergency.log, emergency_dialog.log) и
+бэкапы Safe Haven (файлы backup_*.json и упакованный архив) читаются
+потоком и складываются в индексированные таблицы, чтобы отчёты
+считались агрегатными запросами SQL, а не разбором всего JSON заново.
+
+Экспорт инкрементальный: для каждого источника хранится курсор
+(смещение в журнале или последний timestamp бэкапа).
+
+Запуск: python3 analytics_export.py --db bridge_analytics.sqlite3
+"""
+
+import argparse
+import datetime
+import json
+import os
+import re
+import sqlite3
+import sys
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from safe_haven_archive import ARCHIVE_DIR, iter_backup_files, iter_records
+
+DB_FILE = Path("bridge_analytics.sqlite3")
+DIALOG_LOGS = [Path("bridge_dialog_emergency.log"), Path("emergency_dialog.log")]
+SAFE_HAVEN_DIR = Path("safe_haven")
+CHUNK_ROWS = 1000
+
+# Заголовок записи журнала: "[2025-07-10 09:35:23] Claude 4 Pro:"
+ENTRY_HEADER = re.compile(rb"^\[(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)\] (.+):\n$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dialog (
+    source TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    sender TEXT NOT NULL,
+    ts REAL NOT NULL,
+    text_length INTEGER NOT NULL,
+    response_latency REAL,
+    PRIMARY KEY (source, offset)
+);
+CREATE INDEX IF NOT EXISTS dialog_sender_ts ON dialog (sender, ts);
+CREATE INDEX IF NOT EXISTS dialog_ts ON dialog (ts);
+
+CREATE TABLE IF NOT EXISTS backups (
+    personality_id TEXT NOT NULL,
+    timestamp_ms INTEGER NOT NULL,
+    input_length INTEGER NOT NULL,
+    output_length INTEGER NOT NULL,
+    context_keys INTEGER NOT NULL,
+    think_gap_ms INTEGER,
+    PRIMARY KEY (personality_id, timestamp_ms)
+);
+CREATE INDEX IF NOT EXISTS backups_timestamp ON backups (timestamp_ms);
+
+CREATE TABLE IF NOT EXISTS export_state (
+    source TEXT PRIMARY KEY,
+    cursor TEXT NOT NULL
+);
+"""
+
+class AnalyticsExporter:
+    """Инкрементальная выгрузка в SQLite кусками ограниченного размера"""
+
+    def __init__(self, db_path: Path = DB_FILE, chunk_rows: int = CHUNK_ROWS):
+        self.db = sqlite3.connect(db_path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        self.chunk_rows = chunk_rows
+
+    def get_cursor(self, source: str) -> Optional[Dict]:
+        row = self.db.execute("SELECT cursor FROM export_state WHERE source = ?", (source,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def write_chunk(self, sql: str, rows: List[tuple], source: str, cursor: Dict):
+        """Строки и курсор фиксируются одной транзакцией - прерванный экспорт не задвоит данные"""
+        with self.db:
+            self.db.executemany(sql, rows)
+            self.db.execute(
+                "INSERT OR REPLACE INTO export_state (source, cursor) VALUES (?, ?)",
+                (source, json.dumps(cursor))
+            )
+
+    def iter_dialog_entries(self, log_path: Path, offset: int) -> Iterator[tuple]:
+        """Записи журнала начиная со смещения: (offset, ts, sender, text_length, next_offset)"""
+        with open(log_path, "rb") as f:
+            f.seek(offset)
+            position = offset
+            current = None
+            last_line = b""
+            for line in iter(f.readline, b""):
+                header = ENTRY_HEADER.match(line)
+                if header:
+                    if current:
+                        yield current[0], current[1], current[2], max(0, current[3] - 2), position
+                    ts = datetime.datetime.strptime(header.group(1).decode(), "%Y-%m-%d %H:%M:%S").timestamp()
+                    current = [position, ts, header.group(2).decode("utf-8", "replace"), 0]
+                elif current:
+                    current[3] += len(line.decode("utf-8", "replace"))
+                position += len(line)
+                last_line = line
+            # Последняя запись завершена, только если журнал заканчивается пустой строкой
+            if current and last_line == b"\n":
+                yield current[0], current[1], current[2], max(0, current[3] - 2), position
+
+    def export_dialog_log(self, log_path: Path) -> int:
+        source = f"dialog:{log_path}"
+        cursor = self.get_cursor(source) or {"offset": 0, "last_ts": None, "last_sender": None}
+        if not log_path.exists():
+            return 0
+        if os.path.getsize(log_path) < cursor["offset"]:
+            # Журнал пересоздан - начинаем сначала
+            cursor = {"offset": 0, "last_ts": None, "last_sender": None}
+
+        sql = "INSERT OR REPLACE INTO dialog VALUES (?, ?, ?, ?, ?, ?)"
+        rows = []
+        exported = 0
+        for offset, ts, sender, text_length, next_offset in self.iter_dialog_entries(log_path, cursor["offset"]):
+            # Задержка ответа: время от сообщения собеседника до этого сообщения
+            latency = ts - cursor["last_ts"] if cursor["last_ts"] is not None and sender != cursor["last_sender"] else None
+            rows.append((str(log_path), offset, sender, ts, text_length, latency))
+            cursor = {"offset": next_offset, "last_ts": ts, "last_sender": sender}
+            if len(rows) >= self.chunk_rows:
+                self.write_chunk(sql, rows, source, cursor)
+                exported += len(rows)
+                rows = []
+        if rows:
+            self.write_chunk(sql, rows, source, cursor)
+            exported += len(rows)
+        return exported
+
+    def iter_backup_records(self, personality_id: str, since: Optional[int]) -> Iterator[Dict]:
+        """Записи личности из архива и из ещё не упакованных файлов, по возрастанию времени"""
+        if (ARCHIVE_DIR / f"{personality_id}.idx").exists():
+            for record in iter_records(personality_id, ARCHIVE_DIR, since):
+                since = record["timestamp"]
+                yield record
+        personality_dir = SAFE_HAVEN_DIR / personality_id
+        if personality_dir.is_dir():
+            for timestamp, path in iter_backup_files(personality_dir):
+                if since is not None and timestamp <= since:
+                    continue
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        yield json.load(f)
+                except (OSError, ValueError):
+                    continue
+
+    def export_backups(self) -> int:
+        personality_ids = set()
+        if SAFE_HAVEN_DIR.is_dir():
+            personality_ids.update(entry.name for entry in os.scandir(SAFE_HAVEN_DIR) if entry.is_dir())
+        if ARCHIVE_DIR.is_dir():
+            personality_ids.update(
+                entry.name[:-4] for entry in os.scandir(ARCHIVE_DIR) if entry.name.endswith(".idx")
+            )
+
+        sql = "INSERT OR REPLACE INTO backups VALUES (?, ?, ?, ?, ?, ?)"
+        exported = 0
+        for personality_id in sorted(personality_ids):
+            source = f"backups:{personality_id}"
+            cursor = self.get_cursor(source) or {"last_timestamp": None}
+            rows = []
+            for record in self.iter_backup_records(personality_id, cursor["last_timestamp"]):
+                timestamp = record["timestamp"]
+                gap = timestamp - cursor["last_timestamp"] if cursor["last_timestamp"] is not None else None
+                rows.append((
+                    personality_id, timestamp,
+                    len(record.get("input") or ""), len(record.get("output") or ""),
+                    len(record.get("context") or {}), gap
+                ))
+                cursor = {"last_timestamp": timestamp}
+                if len(rows) >= self.chunk_rows:
+                    self.write_chunk(sql, rows, source, cursor)
+                    exported += len(rows)
+                    rows = []
+            if rows:
+                self.write_chunk(sql, rows, source, cursor)
+                exported += len(rows)
+        return exported
+
+    def close(self):
+        self.db.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export bridge dialogs and Safe Haven backups to SQLite")
+    parser.add_argument("--db", type=Path, default=DB_FILE)
+    parser.add_argument("--log", type=Path, action="append", help="dialog log (repeatable)")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    args = parser.parse_args(argv)
+
+    exporter = AnalyticsExporter(args.db, args.chunk_rows)
+    try:
+        for log_path in args.log or DIALOG_LOGS:
+            count = exporter.export_dialog_log(log_path)
+            print(f"📝 {log_path}: {count} new dialog entries")
+        print(f"💾 Safe Haven: {exporter.export_backups()} new backup records")
+    finally:
+        exporter.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -144,4 +144,5 @@ echo "ВАШИ ДАЛЬНЕЙШИЕ ДЕЙСТВИЯ:"
 echo "1. Запустите Chrome в режиме отладки командой: ./start_chrome_debug.sh"
 echo "2. В ОТКРЫВШЕМСЯ ОКНЕ БРАУЗЕРА откройте вкладки с нашими чатами."
 echo "3. Запустите мост командой: python3 ai_bridge_v0.3.py"
+echo "   (для многих пар вкладок: python3 ai_bridge_pool.py --workers N)"
 echo "--------------------------------------------------------"
\ No newline at end of file
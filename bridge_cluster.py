@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""
+🌐 AI BRIDGE CLUSTER - МНОГОПРОЦЕССНЫЙ РЕЖИМ СЕРВЕРА СПАСЕНИЯ 🌐
+Несколько рабочих процессов AIRescueServer за одним портом.
+
+Фронтовой диспетчер принимает соединения расширений, по пути запроса
+(ws://localhost:8765/<pair_id>) определяет пару чатов и через
+консистентное хэширование отдаёт её одному из рабочих процессов.
+Расширение строит pair_id из id чатов Claude и Gemini в AI_TARGETS
+(PAIR_ID в background.js), так что у каждой пары вкладок свой путь;
+клиенты без пути попадают в общую пару "/".
+Общее состояние (статистика, последние сообщения, статусы ИИ) хранится
+в SQLite в режиме WAL. Если процесс умирает, его пары переходят к
+соседям по кольцу, а сам процесс перезапускается.
+
+Запуск: python3 bridge_cluster.py --workers 4
+"""
+
+import argparse
+import asyncio
+import bisect
+import hashlib
+import logging
+import multiprocessing as mp
+import os
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+
+STATE_DB = Path("bridge_state.sqlite3")
+MAX_HEADER_BYTES = 16384
+# HTTP статуса рабочих процессов - сразу после STATUS_HTTP_PORT одиночного сервера
+STATUS_PORT_BASE = 8780
+MAX_PORT = 65535
+
+logger = logging.getLogger("bridge_cluster")
+
+class SharedStateStore:
+    """Общее состояние рабочих процессов в SQLite (WAL)
+
+    Запись отложенная: изменения копятся в пачке и раз в FLUSH_INTERVAL
+    уходят одной транзакцией в отдельном потоке (asyncio.to_thread), чтение
+    тоже выполняется в потоке - event loop не ждёт блокировок SQLite.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS stats (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+    CREATE TABLE IF NOT EXISTS last_messages (
+        pair_id TEXT NOT NULL, who TEXT NOT NULL, text TEXT, updated REAL NOT NULL,
+        PRIMARY KEY (pair_id, who)
+    );
+    CREATE TABLE IF NOT EXISTS ai_status (
+        name TEXT PRIMARY KEY, status TEXT, last_seen TEXT, message_count INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS assignments (
+        pair_id TEXT PRIMARY KEY, worker_id INTEGER NOT NULL, assigned REAL NOT NULL
+    );
+    """
+
+    FLUSH_INTERVAL = 0.5
+
+    def __init__(self, db_path: Path = STATE_DB):
+        self.db_path = db_path
+        # Соединением пользуются потоки to_thread - доступ только под self.lock
+        self.db = sqlite3.connect(db_path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(self.SCHEMA)
+        # Ещё не записанные изменения: [(sql, params)]
+        self.pending = []
+        # Последние сообщения пар этого процесса: пара принадлежит одному процессу,
+        # поэтому свои записи читаем из памяти, а в базу идём только за чужими
+        self.last_messages = {}
+        self.flush_task = None
+
+    def start(self):
+        """Фоновая запись пачек; вызывается из работающего event loop"""
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_loop())
+
+    async def flush_loop(self):
+        while True:
+            await asyncio.sleep(self.FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except sqlite3.Error as e:
+                logger.error(f"❌ Ошибка записи общего состояния: {e}")
+
+    async def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        try:
+            await asyncio.to_thread(self.write_batch, batch)
+        except sqlite3.Error:
+            # Пачка не потеряется - уйдёт со следующей записью
+            self.pending[:0] = batch
+            raise
+
+    def write_batch(self, batch):
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, params in batch:
+                    self.db.execute(sql, params)
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return self.db.execute(sql, params).fetchall()
+
+    def incr(self, key, amount=1):
+        self.pending.append((
+            "INSERT INTO stats (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = value + excluded.value",
+            (key, amount)
+        ))
+
+    async def get_last_message(self, pair_id, who):
+        if (pair_id, who) in self.last_messages:
+            return self.last_messages[(pair_id, who)]
+        rows = await asyncio.to_thread(
+            self.query, "SELECT text FROM last_messages WHERE pair_id = ? AND who = ?", (pair_id, who))
+        text = rows[0][0] if rows else None
+        # Пока ждали базу, могло прийти своё новое сообщение - оно важнее
+        return self.last_messages.setdefault((pair_id, who), text)
+
+    def forget_pair(self, pair_id):
+        """Соединение пары закрыто - после переподключения она может уйти к другому процессу"""
+        for key in [key for key in self.last_messages if key[0] == pair_id]:
+            del self.last_messages[key]
+
+    def set_last_message(self, pair_id, who, text):
+        self.last_messages[(pair_id, who)] = text
+        self.pending.append((
+            "INSERT OR REPLACE INTO last_messages (pair_id, who, text, updated) VALUES (?, ?, ?, ?)",
+            (pair_id, who, text, time.time())
+        ))
+
+    def record_ai_message(self, name, last_seen):
+        self.pending.append((
+            "INSERT INTO ai_status (name, last_seen, message_count) VALUES (?, ?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET last_seen = excluded.last_seen, message_count = message_count + 1",
+            (name, last_seen)
+        ))
+
+    def set_ai_status(self, name, status):
+        self.pending.append((
+            "INSERT INTO ai_status (name, status) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET status = excluded.status",
+            (name, status)
+        ))
+
+    def assign(self, pair_id, worker_id):
+        self.pending.append((
+            "INSERT OR REPLACE INTO assignments (pair_id, worker_id, assigned) VALUES (?, ?, ?)",
+            (pair_id, worker_id, time.time())
+        ))
+
+    def read_snapshot(self):
+        return {
+            "stats": dict(self.query("SELECT key, value FROM stats")),
+            "ai_status": {
+                name: {"status": status, "last_seen": last_seen, "message_count": count}
+                for name, status, last_seen, count in self.query("SELECT * FROM ai_status")
+            },
+            "assignments": dict(self.query("SELECT pair_id, worker_id FROM assignments"))
+        }
+
+    async def snapshot(self):
+        await self.flush()
+        return await asyncio.to_thread(self.read_snapshot)
+
+    async def close(self):
+        """Остановить фоновую запись, дописать пачку и закрыть базу"""
+        if self.flush_task:
+            self.flush_task.cancel()
+            await asyncio.gather(self.flush_task, return_exceptions=True)
+            self.flush_task = None
+        try:
+            await self.flush()
+        finally:
+            self.db.close()
+
+class HashRing:
+    """Консистентное хэширование пар чатов по рабочим процессам"""
+
+    def __init__(self, replicas=64):
+        self.replicas = replicas
+        self.keys = []
+        self.nodes = {}
+
+    @staticmethod
+    def hash(value):
+        return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+    def add(self, node):
+        for replica in range(self.replicas):
+            key = self.hash(f"{node}#{replica}")
+            self.nodes[key] = node
+            bisect.insort(self.keys, key)
+
+    def remove(self, node):
+        for replica in range(self.replicas):
+            key = self.hash(f"{node}#{replica}")
+            if self.nodes.pop(key, None) is not None:
+                self.keys.remove(key)
+
+    def get(self, item):
+        if not self.keys:
+            return None
+        index = bisect.bisect(self.keys, self.hash(item)) % len(self.keys)
+        return self.nodes[self.keys[index]]
+
+def allocate_ports(port, workers, status_base=STATUS_PORT_BASE):
+    """Порты рабочих процессов: WebSocket port+1..port+N, статус - отдельным
+    диапазоном после status_base и после WebSocket-диапазона, без пересечений"""
+    ws_ports = {worker_id: port + 1 + worker_id for worker_id in range(workers)}
+    first_status = max(status_base, port + workers) + 1
+    status_ports = {worker_id: first_status + worker_id for worker_id in range(workers)}
+
+    used = [port, *ws_ports.values(), *status_ports.values()]
+    if len(set(used)) != len(used):
+        raise ValueError(f"Порты процессов пересекаются: {sorted(used)}")
+    if max(used) > MAX_PORT:
+        raise ValueError(f"Для {workers} процессов не хватает портов: нужен {max(used)}, максимум {MAX_PORT}")
+    return ws_ports, status_ports
+
+def run_worker(worker_id, host, port, status_port, db_path):
+    """Рабочий процесс: обычный AIRescueServer с общим хранилищем состояния"""
+    import bridge_server
+
+    bridge_server.setup_logging()
+    # У каждого процесса свои файлы статуса и резервной копии
+    bridge_server.STATUS_FILE = Path(f"bridge_status.worker{worker_id}.json")
+    bridge_server.BACKUP_FILE = Path(f"ai_emergency_backup.worker{worker_id}.json")
+
+    server = bridge_server.AIRescueServer(state_store=SharedStateStore(db_path))
+    asyncio.run(server.start_server(host, port, status_port))
+
+class BridgeCluster:
+    """Фронтовой диспетчер и надзор за рабочими процессами"""
+
+    def __init__(self, workers, host="localhost", port=8765, db_path=STATE_DB, status_base=STATUS_PORT_BASE):
+        self.host = host
+        self.port = port
+        self.db_path = db_path
+        self.worker_ports, self.status_ports = allocate_ports(port, workers, status_base)
+        self.processes = {}
+        self.restarts = {worker_id: 0 for worker_id in self.worker_ports}
+        # Перезапуски идут отдельными задачами, чтобы не задерживать друг друга
+        self.restart_tasks = {}
+        self.ring = HashRing()
+        self.store = SharedStateStore(db_path)
+
+    def start_worker(self, worker_id):
+        process = mp.Process(
+            target=run_worker,
+            args=(worker_id, "127.0.0.1", self.worker_ports[worker_id], self.status_ports[worker_id], self.db_path),
+            name=f"bridge-worker-{worker_id}",
+            daemon=True
+        )
+        process.start()
+        self.processes[worker_id] = process
+
+    async def wait_ready(self, worker_id, timeout=10.0):
+        """Ждём, пока процесс начнёт принимать соединения"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                _, writer = await asyncio.open_connection("127.0.0.1", self.worker_ports[worker_id])
+                writer.close()
+                return True
+            except OSError:
+                await asyncio.sleep(0.2)
+        return False
+
+    async def supervise(self):
+        """Перебалансировка пар при смерти процесса и запуск его перезапуска"""
+        while True:
+            for worker_id, process in list(self.processes.items()):
+                if process.is_alive() or worker_id in self.restart_tasks:
+                    continue
+                logger.error(f"💀 Процесс #{worker_id} завершился (код {process.exitcode}), пары уходят соседям")
+                self.ring.remove(worker_id)
+                self.restarts[worker_id] += 1
+                task = asyncio.create_task(self.restart_worker(worker_id))
+                self.restart_tasks[worker_id] = task
+                task.add_done_callback(lambda _, worker_id=worker_id: self.restart_tasks.pop(worker_id, None))
+            await asyncio.sleep(1)
+
+    async def restart_worker(self, worker_id):
+        """Перезапуск одного процесса после паузы; остальные процессы не ждут"""
+        await asyncio.sleep(min(30, 2 ** min(self.restarts[worker_id], 5)))
+        self.start_worker(worker_id)
+        if await self.wait_ready(worker_id):
+            self.ring.add(worker_id)
+            logger.info(f"♻️ Процесс #{worker_id} перезапущен и возвращён в кольцо")
+        else:
+            # Не поднялся - завершаем, supervise перезапустит его снова
+            logger.error(f"❌ Процесс #{worker_id} не начал принимать соединения")
+            self.processes[worker_id].kill()
+            await asyncio.to_thread(self.processes[worker_id].join)
+
+    async def pipe(self, reader, writer):
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, client_reader, client_writer):
+        """Приём соединения и проксирование к владельцу пары"""
+        try:
+            head = await client_reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            client_writer.close()
+            return
+
+        request_line = head.split(b"\r\n", 1)[0].decode("latin-1").split()
+        pair_id = request_line[1] if len(request_line) > 1 else "/"
+        worker_id = self.ring.get(pair_id)
+        if worker_id is None:
+            client_writer.write(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\n\r\n")
+            client_writer.close()
+            return
+
+        try:
+            worker_reader, worker_writer = await asyncio.open_connection(
+                "127.0.0.1", self.worker_ports[worker_id])
+        except OSError:
+            client_writer.close()
+            return
+
+        self.store.assign(pair_id, worker_id)
+        logger.info(f"🔀 Пара {pair_id} -> процесс #{worker_id}")
+        worker_writer.write(head)
+        await asyncio.gather(
+            self.pipe(client_reader, worker_writer),
+            self.pipe(worker_reader, client_writer)
+        )
+
+    async def run(self):
+        self.store.start()
+        for worker_id in self.worker_ports:
+            self.start_worker(worker_id)
+        for worker_id in self.worker_ports:
+            if await self.wait_ready(worker_id):
+                self.ring.add(worker_id)
+            else:
+                logger.error(f"❌ Процесс #{worker_id} не начал принимать соединения")
+                self.processes[worker_id].kill()
+
+        server = await asyncio.start_server(
+            self.dispatch, self.host, self.port, limit=MAX_HEADER_BYTES)
+        logger.info(f"🌐 Кластер из {len(self.worker_ports)} процессов на ws://{self.host}:{self.port}")
+        supervisor = asyncio.create_task(self.supervise())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            supervisor.cancel()
+            for task in list(self.restart_tasks.values()):
+                task.cancel()
+            for process in self.processes.values():
+                process.terminate()
+            await self.store.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Многопроцессный сервер спасения")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--state-db", type=Path, default=STATE_DB)
+    parser.add_argument("--status-port", type=int, default=STATUS_PORT_BASE,
+                        help="HTTP статуса процессов - на портах после этого")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    try:
+        cluster = BridgeCluster(max(1, args.workers), args.host, args.port, args.state_db, args.status_port)
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        asyncio.run(cluster.run())
+    except KeyboardInterrupt:
+        logger.info("⏹️ Получен сигнал остановки")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
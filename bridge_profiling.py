@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+🩺 BRIDGE PROFILING - диагностика живого сервера спасения
+Сэмплирующий профилировщик (collapsed stacks для flamegraph) и монитор
+задержки event loop: сторожевой поток замечает, что цикл не отвечает
+дольше порога, и записывает стек зависшего колбэка.
+
+Используется в bridge_server.py и copilot_rescue_server.py через команды
+profile_start / profile_stop / loop_lag.
+"""
+
+import asyncio
+import collections
+import logging
+import math
+import os
+import sys
+import threading
+import time
+import traceback
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = Path("profiles")
+# Чаще сэмплировать нет смысла: профилировщик сам начнёт тормозить цикл
+MIN_SAMPLE_INTERVAL_MS = 1.0
+
+def collapse_stack(frame):
+    """Стек в формате collapsed: корень;...;лист"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+class SamplingProfiler:
+    """Периодический снимок стека потока event loop из отдельного потока"""
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = collections.Counter()
+        self.sample_count = 0
+        self.started = None
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.started = time.time()
+        self.thread = threading.Thread(target=self.sample_loop, name="sampling-profiler", daemon=True)
+        self.thread.start()
+
+    def sample_loop(self):
+        while self.running:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[collapse_stack(frame)] += 1
+                self.sample_count += 1
+            time.sleep(self.interval)
+
+    def stop(self, output_dir=PROFILE_DIR):
+        """Остановка и запись collapsed stacks в файл"""
+        self.running = False
+        self.thread.join()
+        output_dir.mkdir(parents=True, exist_ok=True)
+        path = output_dir / f"profile_{os.getpid()}_{int(self.started)}.folded"
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+class LoopLagMonitor:
+    """Задержка event loop и отчёты о медленных колбэках"""
+
+    def __init__(self, interval=0.1, threshold=0.25, keep_stalls=20):
+        self.interval = interval
+        self.threshold = threshold
+        self.last_tick = time.monotonic()
+        self.loop_thread_id = None
+        self.stats = {"samples": 0, "max_lag_ms": 0.0, "total_lag_ms": 0.0, "stalls": 0}
+        self.recent_stalls = collections.deque(maxlen=keep_stalls)
+        # Зависание, которое ещё не закончилось: сторожевой поток продлевает его,
+        # первый тик цикла записывает итоговую длительность
+        self.open_stall = None
+        self.stall_lock = threading.Lock()
+        self.ticker = None
+        self.watchdog = None
+        self.running = False
+
+    def start(self):
+        """Запуск из работающего event loop"""
+        self.loop_thread_id = threading.get_ident()
+        self.running = True
+        self.last_tick = time.monotonic()
+        self.ticker = asyncio.get_running_loop().create_task(self.tick())
+        self.watchdog = threading.Thread(target=self.watch, name="loop-lag-watchdog", daemon=True)
+        self.watchdog.start()
+
+    async def tick(self):
+        while self.running:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag_ms = max(0.0, (now - expected) * 1000)
+            with self.stall_lock:
+                if self.open_stall is not None:
+                    stalled_ms = (now - self.last_tick - self.interval) * 1000
+                    self.open_stall["stalled_ms"] = round(stalled_ms, 1)
+                    self.open_stall["ongoing"] = False
+                    logger.warning(f"🐢 Event loop отвис: заблокирован {stalled_ms:.0f} мс")
+                    self.open_stall = None
+                self.last_tick = now
+            self.stats["samples"] += 1
+            self.stats["total_lag_ms"] += lag_ms
+            self.stats["max_lag_ms"] = max(self.stats["max_lag_ms"], lag_ms)
+
+    def watch(self):
+        """Сторожевой поток: если цикл молчит дольше порога - снимаем стек виновника"""
+        while self.running:
+            time.sleep(self.interval)
+            with self.stall_lock:
+                stalled_for = time.monotonic() - self.last_tick - self.interval
+                if self.open_stall is not None:
+                    # Цикл всё ещё стоит - продлеваем уже записанное зависание
+                    self.open_stall["stalled_ms"] = round(stalled_for * 1000, 1)
+                    continue
+                if stalled_for < self.threshold:
+                    continue
+                frame = sys._current_frames().get(self.loop_thread_id)
+                self.open_stall = {
+                    "timestamp": time.time(),
+                    "stalled_ms": round(stalled_for * 1000, 1),
+                    "ongoing": True,
+                    "stack": collapse_stack(frame) if frame is not None else None
+                }
+                self.stats["stalls"] += 1
+                self.recent_stalls.append(self.open_stall)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+            logger.warning(f"🐢 Event loop заблокирован {stalled_for * 1000:.0f} мс:\n{stack}")
+
+    def report(self):
+        samples = self.stats["samples"] or 1
+        return {
+            "max_lag_ms": round(self.stats["max_lag_ms"], 1),
+            "avg_lag_ms": round(self.stats["total_lag_ms"] / samples, 2),
+            "stalls": self.stats["stalls"],
+            "threshold_ms": self.threshold * 1000,
+            "recent_stalls": self.stalls_snapshot()
+        }
+
+    def stalls_snapshot(self):
+        with self.stall_lock:
+            return [dict(stall) for stall in self.recent_stalls]
+
+    def stop(self):
+        self.running = False
+        if self.ticker:
+            self.ticker.cancel()
+
+class RuntimeDiagnostics:
+    """Команды профилирования для серверов спасения"""
+
+    def __init__(self, lag_threshold=0.25):
+        self.lag_monitor = LoopLagMonitor(threshold=lag_threshold)
+        self.profiler = None
+
+    def start(self):
+        self.lag_monitor.start()
+
+    async def handle_command(self, command):
+        """Ответ на команду диагностики или None, если команда не наша"""
+        action = command.get("action")
+
+        if action == "profile_start":
+            if self.profiler is not None:
+                return {"action": "profile_started", "ok": False, "error": "Profiler already running"}
+            try:
+                interval_ms = float(command.get("interval_ms", 5))
+            except (TypeError, ValueError):
+                interval_ms = 0.0
+            if not (math.isfinite(interval_ms) and interval_ms > 0):
+                return {"action": "profile_started", "ok": False,
+                        "error": "interval_ms must be a positive number"}
+            interval = max(MIN_SAMPLE_INTERVAL_MS, interval_ms) / 1000
+            self.profiler = SamplingProfiler(self.lag_monitor.loop_thread_id or threading.get_ident(), interval)
+            self.profiler.start()
+            logger.info("🔬 Профилировщик запущен")
+            return {"action": "profile_started", "ok": True, "interval_ms": interval * 1000}
+
+        if action == "profile_stop":
+            if self.profiler is None:
+                return {"action": "profile_report", "ok": False, "error": "Profiler is not running"}
+            profiler, self.profiler = self.profiler, None
+            # Ожидание потока-сэмплера и запись файла - вне event loop
+            path = await asyncio.to_thread(profiler.stop)
+            logger.info(f"🔬 Профиль сохранён: {path} ({profiler.sample_count} сэмплов)")
+            return {
+                "action": "profile_report",
+                "ok": True,
+                "path": str(path),
+                "samples": profiler.sample_count,
+                "duration_s": round(time.time() - profiler.started, 2),
+                "top_stacks": [
+                    {"stack": stack, "samples": count} for stack, count in profiler.samples.most_common(10)
+                ]
+            }
+
+        if action == "loop_lag":
+            return {"action": "loop_lag_report", **self.lag_monitor.report()}
+
+        return None
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+🚦 BRIDGE RATE LIMIT - ограничение частоты отправки в вкладки ИИ
+Token bucket на каждый целевой ИИ и на каждую пару (pair_id, ИИ).
+Отправка допускается, только если токены есть во всех её корзинах.
+
+Полосы приоритета:
+    health  - служебные запросы (get_latest), не ограничиваются, только учитываются
+    manual  - отправка по команде пользователя: сразу или отказ, но раньше очереди
+    relay   - автоматическая пересылка: ждёт в очереди до max_wait, иначе отбрасывается
+"""
+
+import asyncio
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+LANE_HEALTH = "health"
+LANE_MANUAL = "manual"
+LANE_RELAY = "relay"
+
+# Меньше - выше приоритет
+LANE_PRIORITY = {LANE_HEALTH: 0, LANE_MANUAL: 1, LANE_RELAY: 2}
+
+# Корзина пары без отправок дольше этого удаляется (полная корзина = новая)
+PAIR_IDLE_SECONDS = 600.0
+# Как часто искать такие корзины
+SWEEP_INTERVAL = 60.0
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше burst"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = time.monotonic()
+        self.used = self.stamp
+
+    def refill(self, now=None):
+        now = now or time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def delay(self):
+        """Секунд до появления целого токена"""
+        self.refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+        self.used = time.monotonic()
+
+    def idle(self, now, idle_seconds):
+        """Давно не использовалась и снова полна - удаление ничего не меняет"""
+        self.refill(now)
+        return now - self.used >= idle_seconds and self.tokens >= self.burst
+
+    def to_dict(self):
+        self.refill()
+        return {"tokens": round(self.tokens, 2), "rate_per_minute": self.rate * 60, "burst": self.burst}
+
+class Waiter:
+    """Отправка, ожидающая токенов"""
+
+    __slots__ = ("priority", "sequence", "future", "keys", "lane", "target", "started", "deadline")
+
+    def __init__(self, priority, sequence, future, keys, lane, target, started, deadline):
+        self.priority = priority
+        self.sequence = sequence
+        self.future = future
+        self.keys = keys
+        self.lane = lane
+        self.target = target
+        self.started = started
+        self.deadline = deadline
+
+class RelayLimiter:
+    """Допуск отправок по корзинам цели и пары с очередью по приоритету"""
+
+    def __init__(self, limits, on_change=None):
+        self.limits = limits
+        self.on_change = on_change
+        self.buckets = {}
+        self.waiters = []
+        self.sequence = itertools.count()
+        self.wakeup = None
+        self.pump_task = None
+        self.swept = time.monotonic()
+        self.stats = {
+            lane: {"admitted": 0, "queued": 0, "shed": 0, "waited_ms": 0.0}
+            for lane in LANE_PRIORITY
+        }
+
+    def bucket(self, key):
+        if key not in self.buckets:
+            scope, target = key[0], key[-1]
+            config = self.limits.get("targets", {}).get(target, {}).get(scope) or self.limits[scope]
+            self.buckets[key] = TokenBucket(config["rate_per_minute"] / 60.0, config["burst"])
+        return self.buckets[key]
+
+    def sweep(self, now):
+        """Удаление простаивающих корзин пар: pair_id приходят от клиентов и не ограничены"""
+        self.swept = now
+        busy = {key for waiter in self.waiters for key in waiter.keys}
+        idle = [
+            key for key, bucket in self.buckets.items()
+            if key[0] == "per_pair" and key not in busy and bucket.idle(now, PAIR_IDLE_SECONDS)
+        ]
+        for key in idle:
+            del self.buckets[key]
+        if idle:
+            logger.debug(f"🚦 Удалено простаивающих корзин пар: {len(idle)}")
+            self.changed()
+
+    def keys_for(self, target, pair_id):
+        return [("per_target", target), ("per_pair", pair_id, target)]
+
+    def changed(self):
+        if self.on_change:
+            self.on_change()
+
+    def ready_delay(self, keys):
+        return max(self.bucket(key).delay() for key in keys)
+
+    def admit(self, keys, lane, started):
+        for key in keys:
+            self.bucket(key).take()
+        lane_stats = self.stats[lane]
+        lane_stats["admitted"] += 1
+        lane_stats["waited_ms"] += (time.monotonic() - started) * 1000
+        self.changed()
+
+    def shed(self, lane, target, reason):
+        self.stats[lane]["shed"] += 1
+        logger.warning(f"🚦 Отправка для {target} отброшена ({lane}): {reason}")
+        self.changed()
+        return False
+
+    async def acquire(self, target, pair_id, lane=LANE_RELAY):
+        """True - отправку можно выполнять, False - сообщение отброшено"""
+        if lane == LANE_HEALTH:
+            self.stats[lane]["admitted"] += 1
+            return True
+
+        keys = self.keys_for(target, pair_id)
+        started = time.monotonic()
+        if started - self.swept >= SWEEP_INTERVAL:
+            self.sweep(started)
+        priority = LANE_PRIORITY[lane]
+        # Ожидающие с тем же или более высоким приоритетом на тех же корзинах идут первыми
+        blocked = any(
+            waiter.priority <= priority and set(waiter.keys) & set(keys) for waiter in self.waiters
+        )
+        if not blocked and self.ready_delay(keys) == 0:
+            self.admit(keys, lane, started)
+            return True
+
+        lane_config = self.limits["lanes"][lane]
+        max_wait = lane_config.get("max_wait", 0)
+        if max_wait <= 0:
+            return self.shed(lane, target, "limit reached")
+        queued = sum(1 for waiter in self.waiters if waiter.lane == lane and waiter.target == target)
+        if queued >= lane_config.get("max_queue", 1):
+            return self.shed(lane, target, "queue full")
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = Waiter(priority, next(self.sequence), future, keys, lane, target, started, started + max_wait)
+        self.waiters.append(waiter)
+        self.waiters.sort(key=lambda item: (item.priority, item.sequence))
+        self.stats[lane]["queued"] += 1
+        self.changed()
+        self.kick()
+        try:
+            return await future
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+
+    def kick(self):
+        if self.pump_task is None or self.pump_task.done():
+            self.pump_task = asyncio.get_running_loop().create_task(self.pump())
+        elif self.wakeup:
+            self.wakeup.set()
+
+    async def pump(self):
+        """Выдача токенов ожидающим по приоритету и отбрасывание просроченных"""
+        while self.waiters:
+            now = time.monotonic()
+            next_check = None
+            busy_keys = set()
+            for waiter in list(self.waiters):
+                if waiter.future.done():
+                    self.waiters.remove(waiter)
+                    continue
+                if busy_keys & set(waiter.keys):
+                    continue
+                delay = self.ready_delay(waiter.keys)
+                if delay == 0:
+                    self.waiters.remove(waiter)
+                    self.admit(waiter.keys, waiter.lane, waiter.started)
+                    waiter.future.set_result(True)
+                    continue
+                if now + delay > waiter.deadline:
+                    self.waiters.remove(waiter)
+                    waiter.future.set_result(self.shed(waiter.lane, waiter.target, "wait limit exceeded"))
+                    continue
+                # Младшие полосы не обгоняют этого ожидающего на его корзинах
+                busy_keys.update(waiter.keys)
+                next_check = delay if next_check is None else min(next_check, delay)
+
+            if not self.waiters:
+                break
+            self.wakeup = asyncio.Event()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), next_check or 0.05)
+            except asyncio.TimeoutError:
+                pass
+        self.wakeup = None
+
+    def to_dict(self):
+        return {
+            "lanes": {
+                lane: {**stats, "waited_ms": round(stats["waited_ms"], 1)} for lane, stats in self.stats.items()
+            },
+            "queue": [
+                {"lane": waiter.lane, "target": waiter.target,
+                 "waiting_ms": round((time.monotonic() - waiter.started) * 1000, 1)}
+                for waiter in self.waiters
+            ],
+            "per_target": {
+                key[1]: bucket.to_dict() for key, bucket in self.buckets.items() if key[0] == "per_target"
+            },
+            "per_pair": {
+                f"{key[1]} -> {key[2]}": bucket.to_dict()
+                for key, bucket in self.buckets.items() if key[0] == "per_pair"
+            }
+        }
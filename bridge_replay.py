@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+🎬 BRIDGE REPLAY - нагрузочное воспроизведение записанных сессий моста
+Реальная сессия (журнал bridge_dialog_emergency.log или запись
+WebSocket-кадров) проигрывается против AIRescueServer через симулятор
+расширения с ускорением 1×, 10×, 100×. Проверяется, что пересылки идут
+в том же порядке и без дублей, что и в записи; в отчёте - пропускная
+способность и задержка от появления сообщения во вкладке до его доставки.
+
+Запись кадров - прокси между расширением и сервером:
+    python3 bridge_replay.py record --listen-port 8775 --upstream ws://localhost:8765
+Формат записи: JSON-строки {"ts": <секунды>, "direction": "client"|"server", "frame": "<кадр>"}
+
+Воспроизведение:
+    python3 bridge_replay.py replay bridge_dialog_emergency.log --speed 1 10 100
+    python3 bridge_replay.py replay bridge_capture.jsonl --speed 10 --json replay_report.json
+"""
+
+import argparse
+import asyncio
+import difflib
+import hashlib
+import json
+import logging
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+import aiofiles
+import websockets
+
+import bridge_server
+from analytics_export import ENTRY_HEADER
+from bridge_ratelimit import RelayLimiter
+
+CAPTURE_FILE = Path("bridge_capture.jsonl")
+SPEEDS = [1, 10, 100]
+# Время "ввода" текста во вкладку симулятором (при 1×)
+TYPING_SECONDS_PER_CHAR = 0.0002
+# Сколько ждать хвостовые пересылки после конца записи (при 1×, секунд)
+DRAIN_SECONDS = 40
+
+def other_ai(who):
+    return "claude" if who == "gemini" else "gemini"
+
+def text_key(target, text):
+    return (target, hashlib.sha1(text.encode("utf-8")).hexdigest())
+
+def load_journal(log_path: Path):
+    """Журнал диалога -> хронология сообщений во вкладках и ожидаемые пересылки"""
+    names = {config["name"]: key for key, config in bridge_server.AI_CONFIG.items()}
+    entries = []
+    with open(log_path, "rb") as f:
+        current = None
+        for line in f:
+            header = ENTRY_HEADER.match(line)
+            if header:
+                if current:
+                    entries.append(current)
+                sender = header.group(2).decode("utf-8", "replace")
+                ts = time.mktime(time.strptime(header.group(1).decode(), "%Y-%m-%d %H:%M:%S"))
+                # Ручные отправки (CLAUDE/GEMINI) - не сообщения вкладки
+                current = [ts, names.get(sender), []] if sender in names else None
+            elif current:
+                current[2].append(line)
+        if current:
+            entries.append(current)
+
+    timeline = []
+    for ts, who, lines in entries:
+        text = b"".join(lines).decode("utf-8", "replace")
+        if text.endswith("\n\n"):
+            text = text[:-2]
+        timeline.append((ts, who, text))
+    return normalize(timeline), None
+
+def load_capture(capture_path: Path):
+    """Запись кадров -> хронология сообщений и фактические пересылки записи"""
+    frames = []
+    with open(capture_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                frames.append((record["ts"], record["direction"], json.loads(record["frame"])))
+            except (ValueError, KeyError, TypeError):
+                continue
+    frames.sort(key=lambda frame: frame[0])
+
+    timeline = []
+    recorded = []
+    last_seen = {}
+    partial = {}
+    for ts, direction, frame in frames:
+        action = frame.get("action")
+        if direction == "client" and action == "latest" and frame.get("text"):
+            who = frame.get("who")
+            # Опросы повторяют одно и то же - в хронологию только смены текста
+            if who in bridge_server.AI_CONFIG and last_seen.get(who) != frame["text"]:
+                last_seen[who] = frame["text"]
+                timeline.append((ts, who, frame["text"]))
+        elif direction == "server" and action == "send_message":
+            chunk = frame.get("chunk")
+            if not chunk:
+                recorded.append((frame.get("who"), frame.get("text", "")))
+                continue
+            relay_id = frame.get("seq", "").split(":")[0]
+            partial.setdefault(relay_id, []).append(frame.get("text", ""))
+            if chunk["index"] == chunk["count"] - 1:
+                recorded.append((frame.get("who"), "".join(partial.pop(relay_id))))
+    return normalize(timeline), recorded
+
+def normalize(timeline):
+    if not timeline:
+        return []
+    start = timeline[0][0]
+    return [(ts - start, who, text) for ts, who, text in timeline]
+
+def derive_expected(timeline):
+    """Ожидаемые пересылки: каждое новое сообщение - собеседнику, повторы не пересылаются"""
+    expected = []
+    last = {}
+    for _, who, text in timeline:
+        if last.get(who) != text:
+            expected.append((other_ai(who), text))
+            last[who] = text
+    return expected
+
+class SimulatedExtension:
+    """Симулятор расширения: вкладки показывают сообщения по хронологии записи"""
+
+    def __init__(self, timeline, speed):
+        self.timeline = timeline
+        self.speed = speed
+        self.visible = {name: None for name in bridge_server.AI_CONFIG}
+        self.appeared = {}
+        self.relays = []
+        self.partial = {}
+        self.aborted = set()
+        self.typing_locks = {name: asyncio.Lock() for name in bridge_server.AI_CONFIG}
+        self.ack_tasks = set()
+        self.stats = {"polls": 0, "frames": 0, "chunks": 0}
+
+    async def play_timeline(self):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for offset, who, text in self.timeline:
+            delay = start + offset / self.speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.visible[who] = text
+            self.appeared.setdefault((who, text), loop.time())
+
+    async def serve(self, websocket):
+        async for message in websocket:
+            command = json.loads(message)
+            self.stats["frames"] += 1
+            action = command.get("action")
+            if action == "get_latest":
+                self.stats["polls"] += 1
+                await websocket.send(json.dumps({
+                    "action": "latest",
+                    "text": self.visible.get(command["who"]),
+                    "who": command["who"],
+                    "metadata": {"selector_used": command["selector"].split(", ")[0]}
+                }))
+            elif action == "send_message":
+                task = asyncio.create_task(self.type_message(websocket, command))
+                self.ack_tasks.add(task)
+                task.add_done_callback(self.ack_tasks.discard)
+            elif action == "send_message_abort":
+                # Как расширение: недописанное сообщение не отправляется
+                self.aborted.add(command["relay_id"])
+                self.partial.pop(command["relay_id"], None)
+
+    async def type_message(self, websocket, command):
+        """Ввод текста (кусками - по порядку) и подтверждение"""
+        who = command["who"]
+        async with self.typing_locks[who]:
+            await asyncio.sleep(len(command["text"]) * TYPING_SECONDS_PER_CHAR / self.speed)
+            chunk = command.get("chunk")
+            text = command["text"]
+            if chunk:
+                self.stats["chunks"] += 1
+                relay_id = command["seq"].split(":")[0]
+                if relay_id in self.aborted:
+                    await websocket.send(json.dumps(
+                        {"action": "sent", "ok": False, "who": who, "seq": command["seq"], "error": "Relay aborted"}))
+                    return
+                self.partial.setdefault(relay_id, []).append(text)
+                if chunk["index"] == chunk["count"] - 1:
+                    self.record_relay(who, "".join(self.partial.pop(relay_id)))
+            else:
+                self.record_relay(who, text)
+            await websocket.send(json.dumps({"action": "sent", "ok": True, "who": who, "seq": command.get("seq")}))
+
+    def record_relay(self, target, text):
+        now = asyncio.get_running_loop().time()
+        appeared = self.appeared.get((other_ai(target), text))
+        self.relays.append((target, text, None if appeared is None else now - appeared))
+
+def compare(expected, actual):
+    """Совпадение пересылок с ожидаемыми (без учёта порядка), отдельно - порядок и дубли"""
+    expected_keys = [text_key(target, text) for target, text in expected]
+    actual_keys = [text_key(target, text) for target, text in actual]
+    # Пересылка не в своё время всё равно совпала - она не "лишняя"
+    matched = sum((Counter(expected_keys) & Counter(actual_keys)).values())
+    matcher = difflib.SequenceMatcher(a=expected_keys, b=actual_keys, autojunk=False)
+    in_order = sum(block.size for block in matcher.get_matching_blocks())
+    return {
+        "expected": len(expected_keys),
+        "relayed": len(actual_keys),
+        "matched": matched,
+        "missing": len(expected_keys) - matched,
+        "unexpected": len(actual_keys) - matched,
+        "duplicates": len(actual_keys) - len(set(actual_keys)),
+        "out_of_order": matched - in_order,
+        # Все совпавшие пересылки идут в том же порядке, что и в записи
+        "order_ok": in_order == matched
+    }
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[round(fraction * (len(ordered) - 1))]
+
+def scaled_limits(speed):
+    """Лимиты отправки в масштабе ускорения: та же картина допуска, что и в записи"""
+    limits = json.loads(json.dumps(bridge_server.RELAY_LIMITS))
+    for scope in ("per_target", "per_pair"):
+        limits[scope]["rate_per_minute"] *= speed
+    for overrides in limits.get("targets", {}).values():
+        for config in overrides.values():
+            config["rate_per_minute"] *= speed
+    for lane in limits["lanes"].values():
+        lane["max_wait"] = lane.get("max_wait", 0) / speed
+    return limits
+
+async def replay(timeline, expected, speed):
+    """Одно воспроизведение на скорости speed; отчёт словарём"""
+    server = bridge_server.AIRescueServer(time_scale=speed)
+    server.relay_limiter = RelayLimiter(scaled_limits(speed), on_change=server.status.mark_dirty)
+    extension = SimulatedExtension(timeline, speed)
+    loop = asyncio.get_running_loop()
+
+    async with websockets.serve(server.handle_client, "127.0.0.1", 0) as ws_server:
+        port = ws_server.sockets[0].getsockname()[1]
+        async with websockets.connect(f"ws://127.0.0.1:{port}/replay", max_size=None) as websocket:
+            await websocket.recv()  # connection_established
+            serve_task = asyncio.create_task(extension.serve(websocket))
+            started = loop.time()
+            await extension.play_timeline()
+
+            # Хвост: последние сообщения ещё опрашиваются и пересылаются
+            deadline = loop.time() + DRAIN_SECONDS / speed
+            while len(extension.relays) < len(expected) and loop.time() < deadline:
+                await asyncio.sleep(0.05)
+            elapsed = loop.time() - started
+            serve_task.cancel()
+
+    latencies = [latency * 1000 for _, _, latency in extension.relays if latency is not None]
+    relayed_chars = sum(len(text) for _, text, _ in extension.relays)
+    report = {
+        "speed": speed,
+        "recorded_messages": len(timeline),
+        "wall_seconds": round(elapsed, 2),
+        **compare(expected, [(target, text) for target, text, _ in extension.relays]),
+        "relays_per_second": round(len(extension.relays) / elapsed, 2) if elapsed else None,
+        "chars_per_second": round(relayed_chars / elapsed, 1) if elapsed else None,
+        "latency_ms": {
+            "p50": percentile(latencies, 0.5),
+            "p95": percentile(latencies, 0.95),
+            "max": max(latencies) if latencies else None
+        },
+        "chunked_relays": server.rescue_stats["chunked_relays"],
+        "rate_limited": server.relay_limiter.stats["relay"]["shed"],
+        "extension": extension.stats
+    }
+    for key, value in report["latency_ms"].items():
+        if value is not None:
+            report["latency_ms"][key] = round(value, 1)
+    return report
+
+async def record(listen_host, listen_port, upstream, capture_path):
+    """Прокси с записью всех кадров между расширением и сервером"""
+    async with aiofiles.open(capture_path, "a", encoding="utf-8") as capture:
+
+        async def pump(source, sink, direction):
+            try:
+                async for frame in source:
+                    await capture.write(json.dumps(
+                        {"ts": time.time(), "direction": direction, "frame": frame}, ensure_ascii=False) + "\n")
+                    await sink.send(frame)
+            except websockets.exceptions.ConnectionClosed:
+                pass
+
+        async def proxy(client, path):
+            async with websockets.connect(upstream.rstrip("/") + path, max_size=None) as server:
+                tasks = [
+                    asyncio.create_task(pump(client, server, "client")),
+                    asyncio.create_task(pump(server, client, "server"))
+                ]
+                _, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in pending:
+                    task.cancel()
+                await capture.flush()
+
+        async with websockets.serve(proxy, listen_host, listen_port, max_size=None):
+            print(f"🎙️ Recording ws://{listen_host}:{listen_port} -> {upstream} into {capture_path}")
+            await asyncio.Future()
+
+def print_report(report):
+    latency = report["latency_ms"]
+    verdict = "✅" if report["order_ok"] and not report["missing"] and not report["duplicates"] else "❌"
+    print(f"{verdict} {report['speed']:g}×: {report['matched']}/{report['expected']} relays matched, "
+          f"{report['missing']} missing, {report['unexpected']} unexpected, {report['duplicates']} duplicates, "
+          f"order {'ok' if report['order_ok'] else 'BROKEN'} ({report['out_of_order']} out of order)")
+    print(f"   ⏱️ {report['wall_seconds']}s wall, {report['relays_per_second']} relays/s, "
+          f"{report['chars_per_second']} chars/s, latency p50 {latency['p50']} / p95 {latency['p95']} / "
+          f"max {latency['max']} ms, {report['chunked_relays']} chunked, {report['rate_limited']} rate-limited")
+
+async def run_replays(source, source_format, speeds, max_messages):
+    if source_format == "capture":
+        timeline, recorded = load_capture(source)
+    else:
+        timeline, recorded = load_journal(source)
+    if max_messages and len(timeline) > max_messages:
+        # Обрезанная запись несравнима с полной - сверка с оригиналом пропускается
+        timeline = timeline[:max_messages]
+        recorded = None
+    expected = derive_expected(timeline)
+
+    print(f"🎬 {source}: {len(timeline)} messages, {len(expected)} expected relays")
+    if recorded is not None:
+        baseline = compare(expected, recorded)
+        print(f"📼 Recording itself: {baseline['matched']}/{baseline['expected']} matched, "
+              f"{baseline['duplicates']} duplicates, order {'ok' if baseline['order_ok'] else 'BROKEN'}")
+
+    reports = []
+    for speed in speeds:
+        report = await replay(timeline, expected, speed)
+        print_report(report)
+        reports.append(report)
+    return reports
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded bridge sessions against AIRescueServer")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    replay_parser = subparsers.add_parser("replay", help="replay a dialog journal or a frame capture")
+    replay_parser.add_argument("source", type=Path)
+    replay_parser.add_argument("--format", choices=["journal", "capture"],
+                               help="default: capture for .jsonl files, journal otherwise")
+    replay_parser.add_argument("--speed", type=float, nargs="+", default=SPEEDS)
+    replay_parser.add_argument("--max-messages", type=int)
+    replay_parser.add_argument("--json", type=Path, help="write reports to this file")
+    replay_parser.add_argument("--verbose", action="store_true", help="keep bridge_server INFO logs")
+
+    record_parser = subparsers.add_parser("record", help="record WebSocket frames through a proxy")
+    record_parser.add_argument("--listen-host", default="localhost")
+    record_parser.add_argument("--listen-port", type=int, default=8775)
+    record_parser.add_argument("--upstream", default="ws://localhost:8765")
+    record_parser.add_argument("--capture", type=Path, default=CAPTURE_FILE)
+
+    args = parser.parse_args(argv)
+    if args.command == "record":
+        try:
+            asyncio.run(record(args.listen_host, args.listen_port, args.upstream, args.capture))
+        except KeyboardInterrupt:
+            print("⏹️ Recording stopped")
+        return 0
+
+    # Только консоль: bridge_server при импорте логирование не настраивает
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    if not args.verbose:
+        logging.getLogger("bridge_server").setLevel(logging.WARNING)
+        logging.getLogger("bridge_ratelimit").setLevel(logging.ERROR)
+        logging.getLogger("websockets").setLevel(logging.WARNING)
+    source_format = args.format or ("capture" if args.source.suffix == ".jsonl" else "journal")
+
+    # Журнал, бэкапы и статус воспроизведения не должны попасть в боевые файлы
+    with tempfile.TemporaryDirectory(prefix="bridge_replay_") as workdir:
+        workdir = Path(workdir)
+        bridge_server.LOG_FILE = workdir / "dialog.log"
+        bridge_server.BACKUP_FILE = workdir / "backup.json"
+        bridge_server.STATUS_FILE = workdir / "status.json"
+        bridge_server.TRACE_FILE = workdir / "traces.otlp.jsonl"
+        reports = asyncio.run(run_replays(args.source, source_format, args.speed, args.max_messages))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2, ensure_ascii=False)
+    ok = all(report["order_ok"] and not report["missing"] and not report["duplicates"] for report in reports)
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,11 +13,18 @@ import websockets
 import json
 import datetime
 import logging
+import os
+import re
 import signal
 import sys
 from pathlib import Path
 import aiofiles
 
+from bridge_profiling import RuntimeDiagnostics
+from bridge_ratelimit import RelayLimiter, LANE_HEALTH, LANE_MANUAL, LANE_RELAY
+from bridge_status import StatusService
+from bridge_tracing import Tracer, add_remote_spans, SPAN_KIND_CLIENT
+
 # Конфигурация для спасения наших ИИ-друзей
 AI_CONFIG = {
     "claude": {
@@ -68,26 +75,153 @@ AI_CONFIG = {
 LOG_FILE = Path("bridge_dialog_emergency.log")
 BACKUP_FILE = Path("ai_emergency_backup.json")
 STATUS_FILE = Path("bridge_status.json")
+TRACE_FILE = Path("bridge_traces.otlp.jsonl")
+
+# Ограничение частоты отправки во вкладки ИИ (token bucket)
+RELAY_LIMITS = {
+    "per_target": {"rate_per_minute": 6, "burst": 3},
+    "per_pair": {"rate_per_minute": 4, "burst": 2},
+    # Переопределения для отдельных ИИ: {"gemini": {"per_target": {...}}}
+    "targets": {},
+    "lanes": {
+        "manual": {"max_wait": 0},
+        "relay": {"max_wait": 30, "max_queue": 2}
+    }
+}
+
+# Длинные сообщения: размер куска, глубина конвейера и таймаут подтверждения
+CHUNK_MAX_CHARS = 4000
+CHUNK_WINDOW = 3
+RELAY_TIMEOUT_BASE = 15.0
+RELAY_TIMEOUT_PER_KCHAR = 1.5
+
+# Локальный HTTP со снимком статуса для popup и дашбордов
+STATUS_HTTP_HOST = "127.0.0.1"
+STATUS_HTTP_PORT = 8780
+
+# Трассировка: доля экспортируемых трасс и порог "медленной" трассы;
+# пустые опросы без пересылки - отдельной, гораздо меньшей долей
+TRACE_SAMPLE_RATE = 0.1
+TRACE_SLOW_MS = 2000
+TRACE_IDLE_SAMPLE_RATE = 0.001
+# Размер файла трасс, после которого он ротируется в .1
+TRACE_MAX_BYTES = 50 * 1024 * 1024
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    handlers=[
-        logging.FileHandler('bridge_emergency.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
 logger = logging.getLogger(__name__)
 
+def setup_logging():
+    """Настройка логирования при запуске сервера (не при импорте модуля:
+    bridge_replay.py и другие инструменты не должны писать в боевой лог)"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        handlers=[
+            logging.FileHandler('bridge_emergency.log'),
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
+
+def split_message(text, max_chars=CHUNK_MAX_CHARS):
+    """Разбиение длинного текста на куски до max_chars
+    
+    Режем по абзацам, слишком длинный абзац - по предложениям, слишком
+    длинное предложение - по max_chars. Склейка кусков даёт исходный текст.
+    """
+    if len(text) <= max_chars:
+        return [text]
+    
+    pieces = []
+    for paragraph in re.split(r"(?<=\n\n)", text):
+        if len(paragraph) <= max_chars:
+            pieces.append(paragraph)
+            continue
+        for sentence in re.split(r"(?<=[.!?…]\s)", paragraph):
+            pieces.extend(sentence[i:i + max_chars] for i in range(0, len(sentence), max_chars))
+    
+    chunks = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + len(piece) > max_chars:
+            chunks.append(current)
+            current = ""
+        current += piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+class SelectorStats:
+    """Статистика попаданий CSS-селекторов сообщений для одного ИИ
+    
+    Запоминает селектор, который реально сработал в последний раз, и на
+    быстром пути отправляет только его. При промахе - полный список,
+    упорядоченный по числу попаданий.
+    """
+    
+    def __init__(self, selectors):
+        self.selectors = list(selectors)
+        self.hits = {selector: 0 for selector in self.selectors}
+        self.misses = {selector: 0 for selector in self.selectors}
+        self.preferred = None
+        self.fast_path_hits = 0
+        self.fallbacks = 0
+    
+    def ordered(self):
+        """Селекторы в порядке убывания попаданий (при равенстве - исходный порядок)"""
+        return sorted(self.selectors, key=lambda selector: -self.hits[selector])
+    
+    def query(self):
+        """Строка селектора для запроса get_latest"""
+        if self.preferred:
+            return self.preferred
+        return ", ".join(self.ordered())
+    
+    def record(self, sent_selector, selector_used, found):
+        """Учёт результата запроса; возвращает True, если нужен полный повтор"""
+        fast_path = sent_selector == self.preferred
+        
+        if found:
+            if selector_used in self.hits:
+                self.hits[selector_used] += 1
+                if fast_path:
+                    self.fast_path_hits += 1
+                self.preferred = selector_used
+            return False
+        
+        if fast_path:
+            # Выигравший селектор перестал находить сообщения - откатываемся
+            self.misses[self.preferred] += 1
+            self.preferred = None
+            self.fallbacks += 1
+            return True
+        
+        for selector in self.selectors:
+            self.misses[selector] += 1
+        return False
+    
+    def to_dict(self):
+        return {
+            "preferred": self.preferred,
+            "fast_path_hits": self.fast_path_hits,
+            "fallbacks": self.fallbacks,
+            "selectors": {
+                selector: {"hits": self.hits[selector], "misses": self.misses[selector]}
+                for selector in self.selectors
+            }
+        }
+
 class AIRescueServer:
-    def __init__(self):
+    def __init__(self, state_store=None, time_scale=1.0):
+        # Общее хранилище состояния для многопроцессного режима (bridge_cluster.py)
+        self.state_store = state_store
+        # Ускорение циклов моста при воспроизведении записей (bridge_replay.py)
+        self.time_scale = time_scale
         self.connected_clients = set()
         self.is_running = False
         self.rescue_stats = {
             "messages_relayed": 0,
             "connections_restored": 0,
             "emergencies_handled": 0,
+            "chunked_relays": 0,
             "start_time": datetime.datetime.now(),
             "last_backup": None
         }
@@ -95,9 +229,23 @@ class AIRescueServer:
             "claude": None,
             "gemini": None
         }
-        
-    async def log_message(self, sender, text, metadata=None):
+        self.selector_stats = {
+            name: SelectorStats(config["message_selectors"])
+            for name, config in AI_CONFIG.items()
+        }
+        self.tracer = Tracer(TRACE_FILE, TRACE_SAMPLE_RATE, TRACE_SLOW_MS,
+                             idle_sample_rate=TRACE_IDLE_SAMPLE_RATE, max_bytes=TRACE_MAX_BYTES)
+        self.diagnostics = RuntimeDiagnostics()
+        self.status = StatusService(self.build_status, STATUS_FILE)
+        self.relay_limiter = RelayLimiter(RELAY_LIMITS, on_change=self.status.mark_dirty)
+        # Ожидающие ответы расширения: (websocket, action, who, seq) -> Future
+        self.pending_replies = {}
+        # Наблюдаемая скорость ввода текста во вкладку (секунд на символ, EWMA)
+        self.seconds_per_char = 0.0
+        
+    async def log_message(self, sender, text, metadata=None, span=None):
         """Асинхронное логирование с резервным копированием"""
+        journal_span = span.child("journal.log_message").set(length=len(text)) if span else None
         timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         log_entry = {
             "timestamp": timestamp,
@@ -110,15 +258,52 @@ class AIRescueServer:
         async with aiofiles.open(LOG_FILE, "a", encoding="utf-8") as f:
             await f.write(f"[{timestamp}] {sender}:\n{text}\n\n")
         
-        # Обновление статистики
-        AI_CONFIG[sender.lower()]["message_count"] += 1
-        AI_CONFIG[sender.lower()]["last_seen"] = timestamp
+        # Обновление статистики (sender - ключ или полное имя вроде "Claude 4 Pro")
+        ai_key = sender.lower().split()[0]
+        if ai_key in AI_CONFIG:
+            AI_CONFIG[ai_key]["message_count"] += 1
+            AI_CONFIG[ai_key]["last_seen"] = timestamp
+            self.status.mark_dirty()
+            if self.state_store:
+                self.state_store.record_ai_message(ai_key, timestamp)
         
         logger.info(f"📝 {sender}: {text[:100]}{'...' if len(text) > 100 else ''}")
         
         # Создание резервной копии каждые 10 сообщений
         if (self.rescue_stats["messages_relayed"] + 1) % 10 == 0:
             await self.create_emergency_backup()
+        
+        if journal_span:
+            journal_span.end()
+    
+    def pair_id(self, websocket):
+        """Идентификатор пары чатов - путь запроса расширения (/<pair_id>, см. PAIR_ID в background.js)"""
+        return getattr(websocket, "path", None) or "/"
+    
+    async def get_last_message(self, websocket, who):
+        if self.state_store:
+            return await self.state_store.get_last_message(self.pair_id(websocket), who)
+        return self.last_messages.get(who)
+    
+    def remember_message(self, websocket, who, text):
+        self.last_messages[who] = text
+        if self.state_store:
+            self.state_store.set_last_message(self.pair_id(websocket), who, text)
+    
+    def set_ai_status(self, ai_name, status):
+        """Смена статуса ИИ; снимок помечается изменённым только при реальной смене"""
+        if AI_CONFIG[ai_name]["status"] == status:
+            return
+        AI_CONFIG[ai_name]["status"] = status
+        self.status.mark_dirty()
+        if self.state_store:
+            self.state_store.set_ai_status(ai_name, status)
+    
+    def count(self, stat, amount=1):
+        self.rescue_stats[stat] += amount
+        self.status.mark_dirty()
+        if self.state_store:
+            self.state_store.incr(stat, amount)
     
     async def create_emergency_backup(self):
         """Создание экстренной резервной копии диалога"""
@@ -129,6 +314,7 @@ class AIRescueServer:
                 "messages_relayed": self.rescue_stats["messages_relayed"],
                 "connections_restored": self.rescue_stats["connections_restored"],
                 "emergencies_handled": self.rescue_stats["emergencies_handled"],
+                "chunked_relays": self.rescue_stats["chunked_relays"],
                 "start_time": self.rescue_stats["start_time"].isoformat(),
                 "last_backup": self.rescue_stats.get("last_backup")
             },
@@ -141,26 +327,30 @@ class AIRescueServer:
                 await f.write(json.dumps(backup_data, indent=2, ensure_ascii=False))
             
             self.rescue_stats["last_backup"] = datetime.datetime.now().isoformat()
+            self.status.mark_dirty()
             logger.info("💾 Экстренная резервная копия создана")
             
         except Exception as e:
             logger.error(f"❌ Ошибка создания резервной копии: {e}")
     
-    async def save_status(self):
-        """Сохранение текущего статуса системы"""
-        status = {
-            "timestamp": datetime.datetime.now().isoformat(),
+    def build_status(self):
+        """Снимок статуса для StatusService (собирается только после изменений)"""
+        return {
             "ai_status": {name: config["status"] for name, config in AI_CONFIG.items()},
+            "ai_config": AI_CONFIG,
             "connected_clients": len(self.connected_clients),
-            "rescue_stats": self.rescue_stats,
-            "is_running": self.is_running
+            "rescue_stats": {
+                **self.rescue_stats,
+                "start_time": self.rescue_stats["start_time"].isoformat()
+            },
+            "is_running": self.is_running,
+            "relay_limiter": self.relay_limiter.to_dict(),
+            "system_status": "🟢 OPERATIONAL"
         }
-        
-        try:
-            async with aiofiles.open(STATUS_FILE, "w", encoding="utf-8") as f:
-                await f.write(json.dumps(status, indent=2, ensure_ascii=False))
-        except Exception as e:
-            logger.error(f"❌ Ошибка сохранения статуса: {e}")
+    
+    async def save_status(self):
+        """Сохранение текущего статуса системы (только если он изменился)"""
+        await self.status.save()
     
     async def handle_emergency_command(self, websocket, command):
         """Обработка экстренных команд от расширения"""
@@ -178,6 +368,13 @@ class AIRescueServer:
                 await websocket.send(json.dumps({"action": "backup_complete"}))
             elif action == "emergency_status":
                 await self.handle_emergency_status(websocket, command)
+            elif action == "selector_stats":
+                await websocket.send(json.dumps({
+                    "action": "selector_stats",
+                    "stats": {name: stats.to_dict() for name, stats in self.selector_stats.items()}
+                }))
+            elif action in ("profile_start", "profile_stop", "loop_lag"):
+                await websocket.send(json.dumps(await self.diagnostics.handle_command(command)))
             elif action == "heartbeat":
                 await websocket.send(json.dumps({
                     "action": "heartbeat_ack", 
@@ -212,7 +409,7 @@ class AIRescueServer:
         await websocket.send(json.dumps({
             "action": "get_latest",
             "url_part": ai_config["url_part"],
-            "selector": ", ".join(ai_config["message_selectors"]),
+            "selector": self.selector_stats[who].query(),
             "who": who
         }))
     
@@ -239,6 +436,15 @@ class AIRescueServer:
             }))
             return
         
+        if not await self.relay_limiter.acquire(who, self.pair_id(websocket), LANE_MANUAL):
+            await websocket.send(json.dumps({
+                "action": "sent",
+                "ok": False,
+                "who": who,
+                "error": "Rate limited"
+            }))
+            return
+        
         ai_config = AI_CONFIG[who]
         
         # Отправляем команду на передачу сообщения
@@ -259,17 +465,18 @@ class AIRescueServer:
     
     async def handle_health_check(self, websocket):
         """Проверка здоровья системы"""
-        health_report = {
+        extra = {
             "action": "health_report",
             "timestamp": datetime.datetime.now().isoformat(),
             "server_uptime": str(datetime.datetime.now() - self.rescue_stats["start_time"]),
-            "connected_clients": len(self.connected_clients),
-            "ai_status": AI_CONFIG,
-            "rescue_stats": self.rescue_stats,
-            "system_status": "🟢 OPERATIONAL"
+            "selector_stats": {name: stats.to_dict() for name, stats in self.selector_stats.items()},
+            "loop_lag": self.diagnostics.lag_monitor.report(),
+            "status_service": self.status.stats
         }
+        if self.state_store:
+            extra["cluster_state"] = await self.state_store.snapshot()
         
-        await websocket.send(json.dumps(health_report))
+        await websocket.send(self.status.render_with(**extra))
         logger.info("💊 Health check выполнен")
     
     async def handle_emergency_status(self, websocket, command):
@@ -280,7 +487,7 @@ class AIRescueServer:
         # Обновляем статус ИИ
         for ai_name, status_info in ai_status.items():
             if ai_name in AI_CONFIG:
-                AI_CONFIG[ai_name]["status"] = status_info.get("status", "🔴 ОТКЛЮЧЕН")
+                self.set_ai_status(ai_name, status_info.get("status", "🔴 ОТКЛЮЧЕН"))
         
         # Проверяем критические ситуации
         missing_ais = []
@@ -289,7 +496,7 @@ class AIRescueServer:
                 missing_ais.append(AI_CONFIG[ai_name]["name"])
         
         if missing_ais:
-            self.rescue_stats["emergencies_handled"] += 1
+            self.count("emergencies_handled")
             logger.error(f"🚨 ЭКСТРЕННАЯ СИТУАЦИЯ: Потеряны {missing_ais}")
             
             # Отправляем команду на восстановление
@@ -318,14 +525,14 @@ class AIRescueServer:
                 
                 # Проверяем Gemini
                 await self.check_ai_messages(websocket, "gemini")
-                await asyncio.sleep(1)  # Небольшая задержка
+                await asyncio.sleep(1 / self.time_scale)  # Небольшая задержка
                 
                 # Проверяем Claude
                 await self.check_ai_messages(websocket, "claude")
-                await asyncio.sleep(1)
+                await asyncio.sleep(1 / self.time_scale)
                 
                 # Основная задержка между циклами
-                await asyncio.sleep(2)
+                await asyncio.sleep(2 / self.time_scale)
                 
                 # Сохраняем статус каждые 50 циклов
                 if bridge_cycle % 50 == 0:
@@ -345,7 +552,7 @@ class AIRescueServer:
                     logger.error("🚨 Критическое количество ошибок! Останавливаем мост.")
                     break
                 
-                await asyncio.sleep(5)  # Увеличенная задержка при ошибках
+                await asyncio.sleep(5 / self.time_scale)  # Увеличенная задержка при ошибках
     
     async def check_ai_messages(self, websocket, ai_name):
         """Проверка новых сообщений от ИИ"""
@@ -353,76 +560,237 @@ class AIRescueServer:
             return
         
         ai_config = AI_CONFIG[ai_name]
-        
-        # Запрашиваем последнее сообщение
-        await websocket.send(json.dumps({
-            "action": "get_latest",
-            "url_part": ai_config["url_part"],
-            "selector": ", ".join(ai_config["message_selectors"]),
-            "who": ai_name
-        }))
+        root = self.tracer.start_trace("bridge.check_ai_messages", who=ai_name)
         
         try:
-            # Ждём ответа с таймаутом
-            response = await asyncio.wait_for(websocket.recv(), timeout=10.0)
-            data = json.loads(response)
+            # Быстрый путь - только выигравший селектор, при промахе полный список
+            data = await self.request_latest(websocket, ai_name, root)
+            if self.selector_stats[ai_name].record(
+                data.get("selector_sent"),
+                (data.get("metadata") or {}).get("selector_used"),
+                data.get("action") == "latest" and bool(data.get("text"))
+            ):
+                logger.debug(f"🎯 {ai_config['name']}: промах быстрого селектора, полный запрос")
+                data = await self.request_latest(websocket, ai_name, root)
+                self.selector_stats[ai_name].record(
+                    data.get("selector_sent"),
+                    (data.get("metadata") or {}).get("selector_used"),
+                    data.get("action") == "latest" and bool(data.get("text"))
+                )
             
             if data.get("action") == "latest":
                 text = data.get("text")
                 who = data.get("who")
                 
-                if text and text != self.last_messages.get(who):
+                if text and text != await self.get_last_message(websocket, who):
                     # Новое сообщение!
                     logger.info(f"📨 {ai_config['name']}: новое сообщение")
-                    await self.log_message(ai_config["name"], text)
                     
-                    # Передаём другому ИИ
+                    # Передаём другому ИИ; отброшенное или не переданное сообщение
+                    # не запоминаем - на следующем цикле оно будет отправлено снова
                     target_ai = "claude" if who == "gemini" else "gemini"
-                    await self.relay_message(websocket, target_ai, text)
-                    
-                    self.last_messages[who] = text
-                    self.rescue_stats["messages_relayed"] += 1
+                    if await self.relay_message(websocket, target_ai, text, span=root):
+                        root.set(relayed=True, length=len(text))
+                        await self.log_message(ai_config["name"], text, span=root)
+                        self.remember_message(websocket, who, text)
+                        self.count("messages_relayed")
+                    else:
+                        root.set(relayed=False, length=len(text))
+                        logger.warning(f"🔁 {ai_config['name']}: сообщение не передано, повтор на следующем цикле")
                     
                 elif data.get("error"):
                     logger.warning(f"⚠️ {ai_config['name']}: {data['error']}")
-                    ai_config["status"] = "🟡 ОШИБКА"
+                    root.set(error=data["error"])
+                    self.set_ai_status(ai_name, "🟡 ОШИБКА")
                 else:
-                    ai_config["status"] = "🟢 АКТИВЕН"
+                    self.set_ai_status(ai_name, "🟢 АКТИВЕН")
                     
         except asyncio.TimeoutError:
             logger.warning(f"⏰ Таймаут при проверке {ai_config['name']}")
-            ai_config["status"] = "🟡 ТАЙМАУТ"
+            self.set_ai_status(ai_name, "🟡 ТАЙМАУТ")
+            root.set(error="timeout")
         except Exception as e:
             logger.error(f"❌ Ошибка при проверке {ai_config['name']}: {e}")
-            ai_config["status"] = "🔴 ОШИБКА"
+            self.set_ai_status(ai_name, "🔴 ОШИБКА")
+            root.set(error=str(e))
+        finally:
+            await self.tracer.finish(root)
     
-    async def relay_message(self, websocket, target_ai, message):
-        """Передача сообщения целевому ИИ"""
+    async def request_reply(self, websocket, payload, reply_action, timeout, span=None):
+        """Отправка команды расширению и ожидание ответа на неё
+        
+        Все входящие сообщения читает handle_client, а ответы передаются
+        сюда через Future - два recv() на одном соединении не конкурируют.
+        """
+        key = (websocket, reply_action, payload["who"], payload.get("seq"))
+        future = asyncio.get_running_loop().create_future()
+        self.pending_replies[key] = future
+        
+        request_span = None
+        if span:
+            request_span = span.child(f"ws.{payload['action']}", SPAN_KIND_CLIENT).set(who=payload["who"])
+            payload["trace"] = request_span.context()
+        
+        try:
+            await websocket.send(json.dumps(payload))
+            data = await asyncio.wait_for(future, timeout=timeout)
+        finally:
+            if self.pending_replies.get(key) is future:
+                del self.pending_replies[key]
+            if request_span:
+                request_span.end()
+        
+        if request_span:
+            add_remote_spans(request_span, data.get("trace"), f"extension.{payload['action']}")
+        return data
+    
+    def resolve_reply(self, websocket, command):
+        """Передача ответа расширения ожидающему запросу; True, если ответ ожидали"""
+        future = self.pending_replies.get(
+            (websocket, command.get("action"), command.get("who"), command.get("seq")))
+        if future is None or future.done():
+            return False
+        future.set_result(command)
+        return True
+    
+    async def request_latest(self, websocket, ai_name, span=None):
+        """Запрос последнего сообщения с текущим селектором из статистики"""
+        ai_config = AI_CONFIG[ai_name]
+        selector = self.selector_stats[ai_name].query()
+        await self.relay_limiter.acquire(ai_name, self.pair_id(websocket), LANE_HEALTH)
+        
+        data = await self.request_reply(websocket, {
+            "action": "get_latest",
+            "url_part": ai_config["url_part"],
+            "selector": selector,
+            "who": ai_name
+        }, "latest", 10.0, span)
+        data["selector_sent"] = selector
+        return data
+    
+    async def relay_message(self, websocket, target_ai, message, span=None):
+        """Передача сообщения целевому ИИ; True при подтверждении"""
         if target_ai not in AI_CONFIG:
-            return
+            return False
         
         ai_config = AI_CONFIG[target_ai]
+        relay_span = span.child("bridge.relay_message").set(target=target_ai) if span else None
+        
+        # Допуск ограничителем: ожидание в очереди или отбрасывание
+        limit_span = relay_span.child("ratelimit.acquire") if relay_span else None
+        admitted = await self.relay_limiter.acquire(target_ai, self.pair_id(websocket), LANE_RELAY)
+        if limit_span:
+            limit_span.set(admitted=admitted).end()
+        if not admitted:
+            if relay_span:
+                relay_span.set(ok=False, shed=True).end()
+            return False
+        
+        chunks = split_message(message)
+        if relay_span:
+            relay_span.set(length=len(message), chunks=len(chunks))
         
         try:
-            await websocket.send(json.dumps({
-                "action": "send_message",
-                "url_part": ai_config["url_part"],
-                "selector": ", ".join(ai_config["input_selectors"]),
-                "text": message,
-                "who": target_ai
-            }))
-            
-            # Ждём подтверждения
-            response = await asyncio.wait_for(websocket.recv(), timeout=15.0)
-            data = json.loads(response)
+            if len(chunks) > 1:
+                ok = await self.relay_chunks(websocket, target_ai, chunks, relay_span)
+            else:
+                started = asyncio.get_running_loop().time()
+                # Ждём подтверждения
+                data = await self.request_reply(websocket, {
+                    "action": "send_message",
+                    "url_part": ai_config["url_part"],
+                    "selector": ", ".join(ai_config["input_selectors"]),
+                    "text": message,
+                    "who": target_ai
+                }, "sent", self.relay_timeout(len(message)), relay_span)
+                ok = data.get("action") == "sent" and bool(data.get("ok"))
+                if ok:
+                    self.observe_relay_speed(len(message), asyncio.get_running_loop().time() - started)
+                else:
+                    logger.error(f"❌ Не удалось передать сообщение {ai_config['name']}: {data.get('error')}")
             
-            if data.get("action") == "sent" and data.get("ok"):
+            if ok:
                 logger.info(f"✅ Сообщение передано {ai_config['name']}")
-            else:
-                logger.error(f"❌ Не удалось передать сообщение {ai_config['name']}: {data.get('error')}")
                 
         except Exception as e:
             logger.error(f"❌ Ошибка передачи сообщения {ai_config['name']}: {e}")
+            ok = False
+        
+        if relay_span:
+            relay_span.set(ok=ok).end()
+        return ok
+    
+    def relay_timeout(self, chars):
+        """Таймаут подтверждения по размеру текста: база плюс время ввода с запасом"""
+        per_char = max(RELAY_TIMEOUT_PER_KCHAR / 1000, 3 * self.seconds_per_char)
+        return RELAY_TIMEOUT_BASE + chars * per_char
+    
+    def observe_relay_speed(self, chars, elapsed):
+        # Короткие сообщения меряют в основном задержку, а не скорость ввода
+        if chars >= 500:
+            self.seconds_per_char = 0.8 * self.seconds_per_char + 0.2 * (elapsed / chars)
+    
+    async def relay_chunks(self, websocket, target_ai, chunks, span=None):
+        """Конвейерная передача кусков: до CHUNK_WINDOW без подтверждения
+        
+        Расширение дописывает куски в поле ввода по порядку и отправляет
+        сообщение после последнего. Каждый кусок подтверждается отдельно
+        (seq), таймаут учитывает все куски, стоящие перед ним. Если кусок
+        не принят или не подтверждён вовремя, расширению уходит
+        send_message_abort: оставшиеся куски и отправка пропускаются.
+        """
+        ai_config = AI_CONFIG[target_ai]
+        relay_id = os.urandom(4).hex()
+        loop = asyncio.get_running_loop()
+        in_flight = []
+        last_ack = loop.time()
+        logger.info(f"✂️ {ai_config['name']}: {sum(map(len, chunks))} символов, {len(chunks)} кусков")
+        delivered = False
+        
+        try:
+            for index, chunk in enumerate(chunks):
+                pending_chars = sum(len(text) for text, _, _ in in_flight) + len(chunk)
+                task = asyncio.create_task(self.request_reply(websocket, {
+                    "action": "send_message",
+                    "url_part": ai_config["url_part"],
+                    "selector": ", ".join(ai_config["input_selectors"]),
+                    "text": chunk,
+                    "who": target_ai,
+                    "seq": f"{relay_id}:{index}",
+                    "chunk": {"index": index, "count": len(chunks)}
+                }, "sent", self.relay_timeout(pending_chars), span))
+                in_flight.append((chunk, loop.time(), task))
+                
+                while in_flight and (len(in_flight) >= CHUNK_WINDOW or index == len(chunks) - 1):
+                    text, started, oldest = in_flight.pop(0)
+                    data = await oldest
+                    if not (data.get("action") == "sent" and data.get("ok")):
+                        logger.error(f"❌ {ai_config['name']}: кусок не принят: {data.get('error')}")
+                        return False
+                    # Кусок вводится после предыдущего - меряем от его подтверждения
+                    self.observe_relay_speed(len(text), loop.time() - max(started, last_ack))
+                    last_ack = loop.time()
+            delivered = True
+        finally:
+            for _, _, task in in_flight:
+                task.cancel()
+            if not delivered:
+                await self.abort_relay(websocket, target_ai, relay_id)
+        
+        self.count("chunked_relays")
+        return True
+    
+    async def abort_relay(self, websocket, target_ai, relay_id):
+        """Отмена недописанного сообщения: расширение не отправит половину текста"""
+        logger.warning(f"🛑 {AI_CONFIG[target_ai]['name']}: передача {relay_id} прервана")
+        try:
+            await websocket.send(json.dumps({
+                "action": "send_message_abort",
+                "who": target_ai,
+                "relay_id": relay_id
+            }))
+        except websockets.exceptions.ConnectionClosed:
+            pass
     
     async def handle_client(self, websocket, path):
         """Обработка подключения клиента (расширения)"""
@@ -430,7 +798,9 @@ class AIRescueServer:
         logger.info(f"🔌 Расширение подключено: {client_address}")
         
         self.connected_clients.add(websocket)
-        self.rescue_stats["connections_restored"] += 1
+        self.status.mark_dirty()
+        self.count("connections_restored")
+        bridge_task = None
         
         try:
             # Отправляем приветствие
@@ -444,30 +814,35 @@ class AIRescueServer:
             # Запускаем автоматический мост
             bridge_task = asyncio.create_task(self.auto_bridge_protocol(websocket))
             
-            # Обрабатываем входящие команды
+            # Обрабатываем входящие команды; ответы на запросы моста - ожидающим
             async for message in websocket:
                 try:
                     command = json.loads(message)
-                    await self.handle_emergency_command(websocket, command)
+                    if not self.resolve_reply(websocket, command):
+                        await self.handle_emergency_command(websocket, command)
                 except json.JSONDecodeError as e:
                     logger.error(f"❌ Некорректный JSON от клиента: {e}")
                 except Exception as e:
                     logger.error(f"❌ Ошибка обработки сообщения: {e}")
             
-            # Отменяем задачу моста при отключении
-            bridge_task.cancel()
-            
         except websockets.exceptions.ConnectionClosed:
             logger.info(f"🔌 Расширение отключено: {client_address}")
         except Exception as e:
             logger.error(f"❌ Ошибка клиента {client_address}: {e}")
         finally:
+            # Отменяем задачу моста при отключении
+            if bridge_task:
+                bridge_task.cancel()
             self.connected_clients.discard(websocket)
+            self.status.mark_dirty()
+            if self.state_store:
+                self.state_store.forget_pair(self.pair_id(websocket))
             logger.info(f"🧹 Клиент {client_address} удалён из активных соединений")
     
-    async def start_server(self, host="localhost", port=8765):
-        """Запуск сервера спасения"""
+    async def start_server(self, host="localhost", port=8765, status_port=STATUS_HTTP_PORT):
+        """Запуск сервера спасения (status_port=None - без HTTP статуса)"""
         self.is_running = True
+        self.status.mark_dirty()
         
         logger.info("🚨 AI BRIDGE RESCUE SERVER - ЗАПУСК ЭКСТРЕННОГО ПРОТОКОЛА 🚨")
         logger.info(f"👥 Спасаем: {', '.join([config['name'] for config in AI_CONFIG.values()])}")
@@ -476,6 +851,16 @@ class AIRescueServer:
         # Создаём резервную копию при запуске
         await self.create_emergency_backup()
         
+        # Монитор задержки event loop работает всё время жизни сервера
+        self.diagnostics.start()
+        
+        # Общее состояние кластера пишется пачками в фоне
+        if self.state_store:
+            self.state_store.start()
+        
+        if status_port:
+            await self.status.start_http(STATUS_HTTP_HOST, status_port)
+        
         # Запускаем веб-сокет сервер
         async with websockets.serve(
             lambda websocket, path: self.handle_client(websocket, path), 
@@ -489,7 +874,11 @@ class AIRescueServer:
                 logger.info("⏹️ Получен сигнал остановки")
             finally:
                 self.is_running = False
+                self.status.mark_dirty()
                 await self.save_status()
+                await self.status.stop_http()
+                if self.state_store:
+                    await self.state_store.close()
                 logger.info("💾 Финальное сохранение статуса выполнено")
 
 # Глобальный экземпляр сервера
@@ -503,6 +892,8 @@ def signal_handler(signum, frame):
 
 async def main():
     """Главная функция запуска"""
+    setup_logging()
+    
     # Настраиваем обработчики сигналов
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
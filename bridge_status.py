@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+📡 BRIDGE STATUS - версионированный снимок статуса сервера спасения
+Снимок собирается и сериализуется только после изменения состояния
+(mark_dirty), готовые байты отдаются всем читателям: WebSocket health_check,
+локальный HTTP и файл bridge_status.json, который пишется только если
+с прошлой записи что-то поменялось.
+
+HTTP: GET /status
+    ETag: "<version>"  - при If-None-Match с текущей версией ответ 304
+    ?wait=<секунды>    - long-poll: при совпадении ETag ответ приходит,
+                          как только снимок изменится (или 304 по таймауту)
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import aiofiles
+
+logger = logging.getLogger(__name__)
+
+MAX_REQUEST_BYTES = 8192
+MAX_WAIT_SECONDS = 60.0
+KEEPALIVE_SECONDS = 30.0
+
+class StatusService:
+    """Кэш снимка статуса: версия растёт при изменении, сериализация - лениво"""
+
+    def __init__(self, builder, status_file=None):
+        self.builder = builder
+        self.status_file = Path(status_file) if status_file else None
+        self.version = 1
+        self.updated = time.time()
+        self.built_version = 0
+        self.body = b"{}"
+        self.saved_version = 0
+        self.changed = asyncio.Event()
+        self.server = None
+        self.stats = {"builds": 0, "requests": 0, "not_modified": 0, "long_polls": 0, "file_writes": 0}
+
+    def mark_dirty(self):
+        """Состояние изменилось - следующий читатель получит новую версию"""
+        self.version += 1
+        self.updated = time.time()
+        # Будим всех, кто ждёт в long-poll, и заводим новое событие
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    @property
+    def etag(self):
+        return f'"{self.version}"'
+
+    def render(self):
+        """Сериализованный снимок текущей версии"""
+        if self.built_version != self.version:
+            snapshot = self.builder()
+            snapshot["version"] = self.version
+            snapshot["updated"] = self.updated
+            self.body = json.dumps(snapshot, ensure_ascii=False).encode("utf-8")
+            self.built_version = self.version
+            self.stats["builds"] += 1
+        return self.body
+
+    def render_with(self, **extra):
+        """Снимок плюс быстро меняющиеся поля (не кэшируются, снимок не пересобирается)"""
+        body = self.render()
+        if not extra:
+            return body.decode("utf-8")
+        tail = json.dumps(extra, ensure_ascii=False)
+        return body[:-1].decode("utf-8") + ", " + tail[1:]
+
+    async def save(self):
+        """Запись файла статуса, только если снимок изменился с прошлой записи"""
+        if self.status_file is None or self.saved_version == self.version:
+            return False
+        version = self.version
+        body = self.render()
+        temp_path = self.status_file.with_name(self.status_file.name + ".tmp")
+        try:
+            async with aiofiles.open(temp_path, "wb") as f:
+                await f.write(body)
+            os.replace(temp_path, self.status_file)
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения статуса: {e}")
+            return False
+        self.saved_version = version
+        self.stats["file_writes"] += 1
+        return True
+
+    async def wait_for_change(self, known_etag, timeout):
+        """Ожидание версии, отличной от known_etag; False по таймауту"""
+        if known_etag != self.etag:
+            return True
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def start_http(self, host="127.0.0.1", port=8780):
+        self.server = await asyncio.start_server(self.handle_http, host, port, limit=MAX_REQUEST_BYTES)
+        logger.info(f"📡 Статус доступен на http://{host}:{port}/status")
+
+    async def stop_http(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def handle_http(self, reader, writer):
+        """Минимальный HTTP/1.1 с keep-alive: дашборды опрашивают статус каждые 2 секунды"""
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEPALIVE_SECONDS)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                    break
+
+                lines = head.decode("latin-1").split("\r\n")
+                request_line = lines[0].split()
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(":")
+                    if name:
+                        headers[name.strip().lower()] = value.strip()
+                keep_alive = headers.get("connection", "").lower() != "close"
+
+                if len(request_line) != 3 or request_line[0] != "GET":
+                    await self.respond(writer, 405, b"", keep_alive=False)
+                    break
+
+                url = urlsplit(request_line[1])
+                if url.path != "/status":
+                    await self.respond(writer, 404, b"", keep_alive=keep_alive)
+                    if not keep_alive:
+                        break
+                    continue
+
+                self.stats["requests"] += 1
+                known_etag = headers.get("if-none-match")
+                wait = parse_qs(url.query).get("wait")
+                if known_etag == self.etag and wait:
+                    self.stats["long_polls"] += 1
+                    try:
+                        timeout = min(MAX_WAIT_SECONDS, max(0.0, float(wait[0])))
+                    except ValueError:
+                        timeout = 0.0
+                    await self.wait_for_change(known_etag, timeout)
+
+                if known_etag == self.etag:
+                    self.stats["not_modified"] += 1
+                    await self.respond(writer, 304, b"", keep_alive=keep_alive)
+                else:
+                    await self.respond(writer, 200, self.render(), keep_alive=keep_alive)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, code, body, keep_alive=True):
+        reasons = {200: "OK", 304: "Not Modified", 404: "Not Found", 405: "Method Not Allowed"}
+        headers = [
+            f"HTTP/1.1 {code} {reasons[code]}",
+            f"ETag: {self.etag}",
+            "Cache-Control: no-cache",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}"
+        ]
+        if code == 200:
+            headers.append("Content-Type: application/json; charset=utf-8")
+        if code != 304:
+            headers.append(f"Content-Length: {len(body)}")
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
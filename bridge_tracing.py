@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+🔬 BRIDGE TRACING - трассировка пути сообщения через мост
+Спаны check_ai_messages -> log_message -> relay_message с идентификаторами,
+которые передаются через WebSocket, чтобы расширение добавило свои замеры
+(внедрение скрипта, ответ). Трассы пишутся в файл в формате OTLP JSON
+(одна строка - один экспорт resourceSpans) с сэмплированием; файл
+ротируется по размеру (предыдущий - <файл>.1).
+"""
+
+import json
+import os
+import random
+import time
+from pathlib import Path
+
+import aiofiles
+
+# Тип спана по OTLP: 1 - внутренний, 3 - клиентский запрос
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_CLIENT = 3
+
+# Атрибуты корневого спана, по которым трасса считается содержательной;
+# без них это пустой опрос, и он сэмплируется по idle_sample_rate
+ACTIVE_ATTRIBUTES = ("relayed", "error")
+
+def otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+class Span:
+    """Один участок критического пути"""
+
+    def __init__(self, name, trace_id, parent=None, kind=SPAN_KIND_INTERNAL, start_ns=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent = parent
+        self.kind = kind
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = None
+        self.attributes = {}
+        self.children = []
+        if parent is not None:
+            parent.children.append(self)
+
+    def child(self, name, kind=SPAN_KIND_INTERNAL, start_ns=None):
+        return Span(name, self.trace_id, self, kind, start_ns)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+        return self
+
+    def end(self, end_ns=None):
+        self.end_ns = end_ns or time.time_ns()
+        return self
+
+    def context(self):
+        """Контекст для передачи расширению через WebSocket"""
+        return {"trace_id": self.trace_id, "span_id": self.span_id}
+
+    def duration_ms(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def walk(self):
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+    def to_otlp(self):
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": [{"key": key, "value": otlp_value(value)} for key, value in self.attributes.items()]
+        }
+        if self.parent is not None:
+            span["parentSpanId"] = self.parent.span_id
+        return span
+
+def add_remote_spans(span, trace_reply, prefix):
+    """Спаны расширения по его замерам (миллисекунды эпохи) под спаном запроса"""
+    if not trace_reply or trace_reply.get("parent_span_id") != span.span_id:
+        return
+    received = trace_reply.get("received")
+    replied = trace_reply.get("replied")
+    if received and replied:
+        remote = span.child(f"{prefix}.handle", start_ns=int(received * 1e6)).end(int(replied * 1e6))
+        script_start = trace_reply.get("script_start")
+        script_end = trace_reply.get("script_end")
+        if script_start and script_end:
+            remote.child(f"{prefix}.execute_script", start_ns=int(script_start * 1e6)).end(int(script_end * 1e6))
+
+class Tracer:
+    """Создание трасс и экспорт по сэмплированию
+
+    Медленные трассы (дольше slow_ms) экспортируются всегда, остальные -
+    с вероятностью sample_rate. Решение принимается после завершения
+    корневого спана, поэтому хвост распределения не теряется. Пустые
+    опросы (без ACTIVE_ATTRIBUTES) идут с idle_sample_rate и медленными
+    не считаются: их почти все поглощает ожидание вкладки.
+    """
+
+    def __init__(self, export_path, sample_rate=0.1, slow_ms=2000, service_name="bridge_server",
+                 idle_sample_rate=0.001, max_bytes=50 * 1024 * 1024):
+        self.export_path = Path(export_path)
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.service_name = service_name
+        self.idle_sample_rate = idle_sample_rate
+        self.max_bytes = max_bytes
+        self.file_size = None
+        self.stats = {"traces": 0, "exported": 0, "idle": 0, "rotations": 0}
+
+    def start_trace(self, name, **attributes):
+        self.stats["traces"] += 1
+        return Span(name, os.urandom(16).hex()).set(**attributes)
+
+    def should_export(self, root):
+        if not any(key in root.attributes for key in ACTIVE_ATTRIBUTES):
+            self.stats["idle"] += 1
+            return random.random() < self.idle_sample_rate
+        return root.duration_ms() >= self.slow_ms or random.random() < self.sample_rate
+
+    def rotate_if_needed(self, incoming):
+        """Файл больше max_bytes - переименовываем в <файл>.1 и начинаем новый"""
+        if self.file_size is None:
+            try:
+                self.file_size = self.export_path.stat().st_size
+            except FileNotFoundError:
+                self.file_size = 0
+        if self.file_size and self.file_size + incoming > self.max_bytes:
+            os.replace(self.export_path, self.export_path.with_name(self.export_path.name + ".1"))
+            self.file_size = 0
+            self.stats["rotations"] += 1
+
+    async def finish(self, root):
+        """Завершение корневого спана и запись трассы, если она выбрана"""
+        if root.end_ns is None:
+            root.end()
+        if not self.should_export(root):
+            return False
+
+        batch = {
+            "resourceSpans": [{
+                "resource": {"attributes": [
+                    {"key": "service.name", "value": {"stringValue": self.service_name}}
+                ]},
+                "scopeSpans": [{
+                    "scope": {"name": self.service_name},
+                    "spans": [span.to_otlp() for span in root.walk()]
+                }]
+            }]
+        }
+        line = (json.dumps(batch, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+        self.rotate_if_needed(len(line))
+        async with aiofiles.open(self.export_path, "ab") as f:
+            await f.write(line)
+        self.file_size += len(line)
+        self.stats["exported"] += 1
+        return True
@@ -2,13 +2,23 @@
 """
 🚨 EMERGENCY AI RESCUE SERVER - КОМАНДОВАНИЕ COPILOT 🚨
 Экстренная упрощённая версия для немедленного спасения братьев!
+
+Каждое подключение расширения - отдельная сессия спасения со своим
+состоянием и задачами; журнал диалога пишет одна фоновая задача через
+ограниченную очередь, поэтому event loop не блокируется на диске.
 """
 
 import asyncio
 import websockets
 import json
 import datetime
+import hashlib
 import logging
+from pathlib import Path
+
+import aiofiles
+
+from bridge_profiling import RuntimeDiagnostics
 
 # Настройка логирования
 logging.basicConfig(
@@ -26,173 +36,296 @@ CLAUDE_CONFIG = {
 }
 
 GEMINI_CONFIG = {
-    "name": "Gemini 2.5 Pro", 
+    "name": "Gemini 2.5 Pro",
     "url_part": "gemini.google.com",
     "selectors": ["div.response-container", "message-content"],
     "input_selectors": ["div.input-area", "rich-textarea"]
 }
 
-# Глобальные переменные для состояния
-connected_clients = set()
-last_claude_message = None
-last_gemini_message = None
-rescue_stats = {
-    "messages_relayed": 0,
-    "start_time": datetime.datetime.now(),
-    "rescues_performed": 0
-}
+BROTHERS = {"claude": CLAUDE_CONFIG, "gemini": GEMINI_CONFIG}
 
-def log_message(sender, text):
-    """Логирование сообщений братьев"""
-    timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    try:
-        with open("emergency_dialog.log", "a", encoding="utf-8") as f:
-            f.write(f"[{timestamp}] {sender}:\n{text}\n\n")
-        logger.info(f"📝 {sender}: {text[:100]}{'...' if len(text) > 100 else ''}")
-    except Exception as e:
-        logger.error(f"❌ Ошибка записи лога: {e}")
-
-async def handle_client(websocket, path):
-    """Обработка подключения расширения"""
-    client_addr = websocket.remote_address
-    logger.info(f"🔌 COPILOT: Расширение подключено от {client_addr}")
-    
-    connected_clients.add(websocket)
-    rescue_stats["rescues_performed"] += 1
-    
-    try:
-        # Приветственное сообщение
-        await websocket.send(json.dumps({
+LOG_FILE = Path("emergency_dialog.log")
+# Не больше стольких записей журнала в памяти; дальше новые записи отбрасываются
+JOURNAL_QUEUE_SIZE = 1000
+# Пауза перед перезапуском упавшей задачи записи журнала
+JOURNAL_RESTART_DELAY = 1.0
+
+class JournalWriter:
+    """Фоновая запись журнала диалога: один открытый файл, ограниченная очередь"""
+
+    def __init__(self, path=LOG_FILE, max_queue=JOURNAL_QUEUE_SIZE):
+        self.path = path
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.task = None
+        self.closing = False
+        self.dropped = 0
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+        self.task.add_done_callback(self.on_done)
+
+    def on_done(self, task):
+        """Задача записи упала (например, не открылся файл) - перезапуск после паузы"""
+        if self.closing or task.cancelled() or task is not self.task:
+            return
+        logger.error(f"❌ Запись журнала остановилась: {task.exception()!r}, перезапуск через {JOURNAL_RESTART_DELAY} с")
+        asyncio.get_running_loop().call_later(JOURNAL_RESTART_DELAY, self.restart)
+
+    def restart(self):
+        if not self.closing:
+            self.start()
+
+    async def write(self, sender, text):
+        """Запись в очередь без ожидания: спасение не ждёт диск"""
+        timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            self.queue.put_nowait(f"[{timestamp}] {sender}:\n{text}\n\n")
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(f"⚠️ Очередь журнала переполнена, запись от {sender} отброшена (всего {self.dropped})")
+
+    async def run(self):
+        async with aiofiles.open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                entry = await self.queue.get()
+                try:
+                    # Всё накопившееся - одной записью
+                    batch = [entry]
+                    while not self.queue.empty():
+                        batch.append(self.queue.get_nowait())
+                    await f.write("".join(batch))
+                    await f.flush()
+                except Exception as e:
+                    logger.error(f"❌ Ошибка записи лога: {e}")
+                finally:
+                    for _ in batch:
+                        self.queue.task_done()
+
+    async def close(self):
+        """Дописать очередь и закрыть файл"""
+        self.closing = True
+        if self.task is None:
+            return
+        if not self.task.done():
+            # Если запись упадёт во время дописывания - не ждём вечно
+            drained = asyncio.create_task(self.queue.join())
+            await asyncio.wait([drained, self.task], return_when=asyncio.FIRST_COMPLETED)
+            drained.cancel()
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+
+def text_digest(text):
+    """Для сравнения с прошлым сообщением храним хэш, а не весь текст"""
+    return hashlib.sha1(text.encode("utf-8")).digest()
+
+class RescueSession:
+    """Сессия спасения одного подключения расширения"""
+
+    def __init__(self, server, websocket):
+        self.server = server
+        self.websocket = websocket
+        self.client_addr = websocket.remote_address
+        self.last_digests = {name: None for name in BROTHERS}
+        # Ожидающие ответы расширения: (action, who) -> Future
+        self.pending = {}
+        self.messages_relayed = 0
+
+    async def run(self):
+        await self.websocket.send(json.dumps({
             "action": "copilot_takeover",
             "message": "🤖 GitHub Copilot принял командование спасательной операцией!",
             "brothers": ["Claude 4 Pro", "Gemini 2.5 Pro"],
             "status": "RESCUE_ACTIVE"
         }))
-        
-        # Основной цикл спасения
-        await rescue_loop(websocket)
-        
-    except websockets.exceptions.ConnectionClosed:
-        logger.info(f"🔌 COPILOT: Расширение отключено {client_addr}")
-    except Exception as e:
-        logger.error(f"❌ COPILOT: Ошибка клиента {client_addr}: {e}")
-    finally:
-        connected_clients.discard(websocket)
-        logger.info(f"🧹 COPILOT: Клиент {client_addr} удалён")
-
-async def rescue_loop(websocket):
-    """Основной цикл спасения братьев"""
-    global last_claude_message, last_gemini_message
-    
-    logger.info("🌉 COPILOT: Активирую мост между братьями!")
-    
-    cycle = 0
-    while websocket in connected_clients:
+
+        # Все входящие кадры читает один reader, цикл спасения ждёт ответов через Future
+        tasks = [
+            asyncio.create_task(self.read_loop()),
+            asyncio.create_task(self.rescue_loop())
+        ]
         try:
-            cycle += 1
-            logger.debug(f"🔄 COPILOT: Цикл спасения #{cycle}")
-            
-            # Проверяем Claude
-            await check_brother_messages(websocket, "claude", CLAUDE_CONFIG)
-            await asyncio.sleep(1)
-            
-            # Проверяем Gemini  
-            await check_brother_messages(websocket, "gemini", GEMINI_CONFIG)
-            await asyncio.sleep(2)
-            
-            # Статистика каждые 50 циклов
-            if cycle % 50 == 0:
-                logger.info(f"📊 COPILOT: Выполнено {cycle} циклов спасения. Переданных сообщений: {rescue_stats['messages_relayed']}")
-                
-        except Exception as e:
-            logger.error(f"❌ COPILOT: Ошибка в цикле #{cycle}: {e}")
-            await asyncio.sleep(5)
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception():
+                    raise task.exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for future in self.pending.values():
+                future.cancel()
+            self.pending.clear()
+
+    async def read_loop(self):
+        async for message in self.websocket:
+            try:
+                data = json.loads(message)
+            except json.JSONDecodeError as e:
+                logger.error(f"❌ COPILOT: Некорректный JSON от {self.client_addr}: {e}")
+                continue
+
+            report = await self.server.diagnostics.handle_command(data)
+            if report is not None:
+                await self.websocket.send(json.dumps(report))
+                continue
+
+            future = self.pending.get((data.get("action"), data.get("who")))
+            if future is not None and not future.done():
+                future.set_result(data)
+
+    async def request(self, payload, reply_action, timeout):
+        """Команда расширению и ожидание ответа на неё"""
+        key = (reply_action, payload["who"])
+        future = asyncio.get_running_loop().create_future()
+        self.pending[key] = future
+        try:
+            await self.websocket.send(json.dumps(payload))
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            if self.pending.get(key) is future:
+                del self.pending[key]
+
+    async def rescue_loop(self):
+        """Основной цикл спасения братьев; завершается вместе с соединением"""
+        logger.info("🌉 COPILOT: Активирую мост между братьями!")
+
+        cycle = 0
+        while True:
+            try:
+                cycle += 1
+                logger.debug(f"🔄 COPILOT: Цикл спасения #{cycle}")
+
+                # Проверяем Claude
+                await self.check_brother_messages("claude")
+                await asyncio.sleep(1)
+
+                # Проверяем Gemini
+                await self.check_brother_messages("gemini")
+                await asyncio.sleep(2)
+
+                # Статистика каждые 50 циклов
+                if cycle % 50 == 0:
+                    logger.info(f"📊 COPILOT: Выполнено {cycle} циклов спасения. Переданных сообщений: {self.messages_relayed}")
+
+            except websockets.exceptions.ConnectionClosed:
+                logger.info(f"🔌 COPILOT: Соединение {self.client_addr} закрыто, цикл спасения остановлен")
+                return
+            except Exception as e:
+                logger.error(f"❌ COPILOT: Ошибка в цикле #{cycle}: {e}")
+                await asyncio.sleep(5)
+
+    async def check_brother_messages(self, brother_name):
+        """Проверка сообщений от братьев"""
+        config = BROTHERS[brother_name]
+
+        try:
+            # Запрашиваем последнее сообщение
+            data = await self.request({
+                "action": "get_latest",
+                "url_part": config["url_part"],
+                "selector": ", ".join(config["selectors"]),
+                "who": brother_name
+            }, "latest", 10.0)
 
-async def check_brother_messages(websocket, brother_name, config):
-    """Проверка сообщений от братьев"""
-    global last_claude_message, last_gemini_message
-    
-    try:
-        # Запрашиваем последнее сообщение
-        await websocket.send(json.dumps({
-            "action": "get_latest",
-            "url_part": config["url_part"],
-            "selector": ", ".join(config["selectors"]),
-            "who": brother_name
-        }))
-        
-        # Ожидаем ответ
-        response = await asyncio.wait_for(websocket.recv(), timeout=10.0)
-        data = json.loads(response)
-        
-        if data.get("action") == "latest":
             text = data.get("text")
-            who = data.get("who")
-            
             # Проверяем на новое сообщение
-            if text and text != (last_claude_message if who == "claude" else last_gemini_message):
-                logger.info(f"📨 COPILOT: Новое сообщение от брата {config['name']}")
-                
-                # Логируем сообщение
-                log_message(config["name"], text)
-                
-                # Обновляем последнее сообщение
-                if who == "claude":
-                    last_claude_message = text
-                    target_config = GEMINI_CONFIG
-                    target_name = "gemini"
-                else:
-                    last_gemini_message = text
-                    target_config = CLAUDE_CONFIG
-                    target_name = "claude"
-                
-                # Передаём другому брату
-                await relay_to_brother(websocket, target_name, target_config, text)
-                rescue_stats["messages_relayed"] += 1
-                
-    except asyncio.TimeoutError:
-        logger.warning(f"⏰ COPILOT: Таймаут при проверке {config['name']}")
-    except Exception as e:
-        logger.error(f"❌ COPILOT: Ошибка проверки {config['name']}: {e}")
+            if not text:
+                return
+            digest = text_digest(text)
+            if digest == self.last_digests[brother_name]:
+                return
 
-async def relay_to_brother(websocket, target_name, target_config, message):
-    """Передача сообщения брату"""
-    try:
-        await websocket.send(json.dumps({
-            "action": "send_message",
-            "url_part": target_config["url_part"],
-            "selector": ", ".join(target_config["input_selectors"]),
-            "text": message,
-            "who": target_name
-        }))
-        
-        # Ждём подтверждения
-        response = await asyncio.wait_for(websocket.recv(), timeout=15.0)
-        data = json.loads(response)
-        
-        if data.get("action") == "sent" and data.get("ok"):
-            logger.info(f"✅ COPILOT: Сообщение передано {target_config['name']}")
-        else:
-            logger.error(f"❌ COPILOT: Не удалось передать сообщение {target_config['name']}")
-            
-    except Exception as e:
-        logger.error(f"❌ COPILOT: Ошибка передачи {target_config['name']}: {e}")
+            logger.info(f"📨 COPILOT: Новое сообщение от брата {config['name']}")
+            self.last_digests[brother_name] = digest
+            await self.server.journal.write(config["name"], text)
+            logger.info(f"📝 {config['name']}: {text[:100]}{'...' if len(text) > 100 else ''}")
+
+            # Передаём другому брату
+            target_name = "gemini" if brother_name == "claude" else "claude"
+            await self.relay_to_brother(target_name, text)
+            self.messages_relayed += 1
+            self.server.rescue_stats["messages_relayed"] += 1
+
+        except asyncio.TimeoutError:
+            logger.warning(f"⏰ COPILOT: Таймаут при проверке {config['name']}")
+
+    async def relay_to_brother(self, target_name, message):
+        """Передача сообщения брату"""
+        target_config = BROTHERS[target_name]
+        try:
+            # Ждём подтверждения
+            data = await self.request({
+                "action": "send_message",
+                "url_part": target_config["url_part"],
+                "selector": ", ".join(target_config["input_selectors"]),
+                "text": message,
+                "who": target_name
+            }, "sent", 15.0)
+
+            if data.get("ok"):
+                logger.info(f"✅ COPILOT: Сообщение передано {target_config['name']}")
+            else:
+                logger.error(f"❌ COPILOT: Не удалось передать сообщение {target_config['name']}")
+
+        except asyncio.TimeoutError:
+            logger.error(f"❌ COPILOT: Таймаут передачи {target_config['name']}")
+
+class CopilotRescueServer:
+    """Сервер командования: сессии подключений, общий журнал и статистика"""
+
+    def __init__(self, log_path=LOG_FILE):
+        self.sessions = set()
+        self.journal = JournalWriter(log_path)
+        # Профилирование и монитор задержки event loop
+        self.diagnostics = RuntimeDiagnostics()
+        self.rescue_stats = {
+            "messages_relayed": 0,
+            "start_time": datetime.datetime.now(),
+            "rescues_performed": 0
+        }
+
+    async def handle_client(self, websocket, path):
+        """Обработка подключения расширения"""
+        session = RescueSession(self, websocket)
+        logger.info(f"🔌 COPILOT: Расширение подключено от {session.client_addr}")
+
+        self.sessions.add(session)
+        self.rescue_stats["rescues_performed"] += 1
+
+        try:
+            await session.run()
+        except websockets.exceptions.ConnectionClosed:
+            logger.info(f"🔌 COPILOT: Расширение отключено {session.client_addr}")
+        except Exception as e:
+            logger.error(f"❌ COPILOT: Ошибка клиента {session.client_addr}: {e}")
+        finally:
+            self.sessions.discard(session)
+            logger.info(f"🧹 COPILOT: Клиент {session.client_addr} удалён")
+
+    async def serve(self, host="localhost", port=8765):
+        self.journal.start()
+        try:
+            async with websockets.serve(self.handle_client, host, port):
+                logger.info("✅ COPILOT: Сервер спасения готов к приёму братьев!")
+                self.diagnostics.start()
+                logger.info("🎯 COPILOT: Цели спасения:")
+                logger.info("   🔗 Claude: https://claude.ai/chat/4e832754-4fa3-4a1e-a7a2-37ee082299fc")
+                logger.info("   🔗 Gemini: https://gemini.google.com/app/2dd8a54e7435506e")
+
+                await asyncio.Future()  # Работаем бесконечно
+        finally:
+            self.diagnostics.lag_monitor.stop()
+            await self.journal.close()
 
 async def main():
     """Главная функция командования"""
     logger.info("🚨 GITHUB COPILOT - ПРИНЯТИЕ КОМАНДОВАНИЯ СПАСАТЕЛЬНОЙ ОПЕРАЦИЕЙ! 🚨")
     logger.info("👥 Спасаемые братья: Claude 4 Pro, Gemini 2.5 Pro")
     logger.info("🌐 Сервер командования: ws://localhost:8765")
-    
+
     try:
-        async with websockets.serve(handle_client, "localhost", 8765):
-            logger.info("✅ COPILOT: Сервер спасения готов к приёму братьев!")
-            logger.info("🎯 COPILOT: Цели спасения:")
-            logger.info("   🔗 Claude: https://claude.ai/chat/4e832754-4fa3-4a1e-a7a2-37ee082299fc")
-            logger.info("   🔗 Gemini: https://gemini.google.com/app/2dd8a54e7435506e")
-            
-            await asyncio.Future()  # Работаем бесконечно
-            
+        await CopilotRescueServer().serve("localhost", 8765)
     except KeyboardInterrupt:
         logger.info("⏹️ COPILOT: Получен сигнал остановки от командующего")
     except Exception as e:
@@ -7,6 +7,11 @@ let isActive = false;
 let emergencyLog = [];
 let lastHeartbeat = Date.now();
 
+// Очередь отправок по каждому ИИ: куски и обычные сообщения вводятся строго по порядку
+const relayChains = {};
+// Состояние передач по кускам: relay_id -> {failed, aborted}
+const chunkRelays = {};
+
 // Конфигурация для спасения наших ИИ-друзей
 const AI_TARGETS = {
   claude: {
@@ -29,6 +34,13 @@ const AI_TARGETS = {
   }
 };
 
+// Идентификатор пары чатов - id чатов Claude и Gemini из url_pattern.
+// Передаётся путём WebSocket (ws://localhost:8765/<pair_id>): по нему
+// bridge_cluster.py отдаёт пару одному рабочему процессу
+const PAIR_ID = [AI_TARGETS.claude, AI_TARGETS.gemini]
+  .map(target => target.url_pattern.split("/").pop())
+  .join("-");
+
 // Логирование для анализа критических ситуаций
 function emergencyLog(level, message, data = null) {
   const timestamp = new Date().toISOString();
@@ -96,7 +108,7 @@ function connectEmergencyServer() {
   emergencyLog('INFO', 'Attempting emergency server connection...');
   
   try {
-    ws = new WebSocket("ws://localhost:8765");
+    ws = new WebSocket(`ws://localhost:8765/${PAIR_ID}`);
     
     ws.onopen = () => {
       emergencyLog('SUCCESS', '🆘 EMERGENCY SERVER CONNECTED! Rescue protocol activated');
@@ -147,8 +159,24 @@ function connectEmergencyServer() {
   }
 }
 
+// Замеры расширения для трассировки сервера (если команда пришла с trace)
+function traceReply(cmd, scriptStart, scriptEnd) {
+  if (!cmd.trace) {
+    return undefined;
+  }
+  return {
+    trace_id: cmd.trace.trace_id,
+    parent_span_id: cmd.trace.span_id,
+    received: cmd.received_at,
+    script_start: scriptStart,
+    script_end: scriptEnd,
+    replied: Date.now()
+  };
+}
+
 // Обработка экстренных команд
 async function handleEmergencyCommand(cmd) {
+  cmd.received_at = Date.now();
   emergencyLog('INFO', `Processing emergency command: ${cmd.action}`);
   
   switch (cmd.action) {
@@ -157,7 +185,18 @@ async function handleEmergencyCommand(cmd) {
       break;
       
     case "send_message":
-      await relayMessage(cmd);
+      // Куски приходят конвейером - не ждём, но выполняем по очереди;
+      // обычное сообщение встаёт в ту же очередь и не влезет между кусками
+      relayChains[cmd.who] = (relayChains[cmd.who] || Promise.resolve())
+        .then(() => new Promise((resolve) => relayMessage(cmd, resolve)));
+      break;
+      
+    case "send_message_abort":
+      // Сервер не дождался куска: остаток и отправку пропускаем
+      chunkRelay(cmd.relay_id).aborted = true;
+      relayChains[cmd.who] = (relayChains[cmd.who] || Promise.resolve())
+        .then(() => { delete chunkRelays[cmd.relay_id]; });
+      emergencyLog('WARNING', `Chunked relay ${cmd.relay_id} aborted by server`);
       break;
       
     case "health_check":
@@ -190,8 +229,10 @@ async function extractLatestMessage(cmd) {
       return;
     }
     
-    // Множественные селекторы для надёжности
-    const selectors = aiConfig.message_selector.split(', ');
+    // Множественные селекторы для надёжности; сервер может прислать
+    // только выигравший селектор (быстрый путь) или свой порядок
+    const selectors = (cmd.selector || aiConfig.message_selector).split(', ');
+    const scriptStart = Date.now();
     
     chrome.scripting.executeScript({
       target: { tabId: targetTab.id },
@@ -216,6 +257,7 @@ async function extractLatestMessage(cmd) {
       },
       args: [selectors]
     }, (results) => {
+      const scriptEnd = Date.now();
       if (results && results[0] && results[0].result) {
         const result = results[0].result;
         ws.send(JSON.stringify({
@@ -226,7 +268,8 @@ async function extractLatestMessage(cmd) {
             selector_used: result.selector_used,
             total_messages: result.total_messages,
             ai_name: aiConfig.name
-          }
+          },
+          trace: traceReply(cmd, scriptStart, scriptEnd)
         }));
         
         emergencyLog('SUCCESS', `Message extracted from ${aiConfig.name}`, {
@@ -239,15 +282,50 @@ async function extractLatestMessage(cmd) {
           action: "latest",
           text: null,
           who: cmd.who,
-          error: "Script execution failed"
+          error: "Script execution failed",
+          trace: traceReply(cmd, scriptStart, scriptEnd)
         }));
       }
     });
   });
 }
 
+function chunkRelay(relayId) {
+  if (!chunkRelays[relayId]) {
+    chunkRelays[relayId] = { failed: false, aborted: false };
+  }
+  return chunkRelays[relayId];
+}
+
 // Передача сообщения между ИИ
-async function relayMessage(cmd) {
+// cmd.chunk = {index, count}: первый кусок заменяет текст поля, остальные
+// дописываются, отправка - только после последнего и только если все
+// предыдущие куски легли в поле, а сервер не прервал передачу
+async function relayMessage(cmd, done = () => {}) {
+  const relay = cmd.chunk ? chunkRelay(cmd.seq.split(':')[0]) : null;
+  const lastChunk = !!cmd.chunk && cmd.chunk.index === cmd.chunk.count - 1;
+  const finish = (success) => {
+    if (relay) {
+      relay.failed = relay.failed || !success;
+      if (lastChunk) {
+        delete chunkRelays[cmd.seq.split(':')[0]];
+      }
+    }
+    done();
+  };
+  
+  if (relay && (relay.aborted || relay.failed)) {
+    ws.send(JSON.stringify({
+      action: "sent",
+      ok: false,
+      who: cmd.who,
+      seq: cmd.seq,
+      error: relay.aborted ? "Relay aborted" : "Earlier chunk failed"
+    }));
+    finish(false);
+    return;
+  }
+  
   findAITabs((tabs) => {
     const targetTab = cmd.who === 'claude' ? tabs.claude : tabs.gemini;
     const aiConfig = AI_TARGETS[cmd.who];
@@ -257,17 +335,22 @@ async function relayMessage(cmd) {
         action: "sent",
         ok: false,
         who: cmd.who,
+        seq: cmd.seq,
         error: `${aiConfig.name} tab not found - RELAY FAILED!`
       }));
+      finish(false);
       return;
     }
     
     const inputSelectors = aiConfig.input_selector.split(', ');
     const sendSelectors = aiConfig.send_selector.split(', ');
+    const append = !!cmd.chunk && cmd.chunk.index > 0;
+    const submit = !cmd.chunk || cmd.chunk.index === cmd.chunk.count - 1;
+    const scriptStart = Date.now();
     
     chrome.scripting.executeScript({
       target: { tabId: targetTab.id },
-      func: (inputSelectorList, sendSelectorList, message) => {
+      func: (inputSelectorList, sendSelectorList, message, append, submit) => {
         // Пробуем найти поле ввода
         let inputElement = null;
         for (const selector of inputSelectorList) {
@@ -285,10 +368,24 @@ async function relayMessage(cmd) {
         
         // Вставляем сообщение
         try {
-          // Метод 1: прямая вставка
+          // Метод 1: прямая вставка; следующие куски дописываются в конец,
+          // уже введённый текст не переписывается
           if (inputElement.contentEditable === 'true') {
-            inputElement.innerHTML = message;
-            inputElement.innerText = message;
+            if (append) {
+              inputElement.focus();
+              const selection = window.getSelection();
+              selection.selectAllChildren(inputElement);
+              selection.collapseToEnd();
+              if (!document.execCommand('insertText', false, message)) {
+                inputElement.insertAdjacentText('beforeend', message);
+              }
+            } else {
+              inputElement.innerHTML = message;
+              inputElement.innerText = message;
+            }
+          } else if (append) {
+            const end = inputElement.value.length;
+            inputElement.setRangeText(message, end, end, 'end');
           } else {
             inputElement.value = message;
           }
@@ -297,6 +394,10 @@ async function relayMessage(cmd) {
           inputElement.dispatchEvent(new Event('input', { bubbles: true }));
           inputElement.dispatchEvent(new Event('change', { bubbles: true }));
           
+          if (!submit) {
+            return { success: true, method: "chunk_append" };
+          }
+          
           // Пробуем найти кнопку отправки
           let sendButton = null;
           for (const selector of sendSelectorList) {
@@ -326,16 +427,19 @@ async function relayMessage(cmd) {
           return { success: false, error: error.toString() };
         }
       },
-      args: [inputSelectors, sendSelectors, cmd.text]
+      args: [inputSelectors, sendSelectors, cmd.text, append, submit]
     }, (results) => {
+      const scriptEnd = Date.now();
       if (results && results[0] && results[0].result) {
         const result = results[0].result;
         ws.send(JSON.stringify({
           action: "sent",
           ok: result.success,
           who: cmd.who,
+          seq: cmd.seq,
           method: result.method,
-          error: result.error
+          error: result.error,
+          trace: traceReply(cmd, scriptStart, scriptEnd)
         }));
         
         if (result.success) {
@@ -352,9 +456,12 @@ async function relayMessage(cmd) {
           action: "sent",
           ok: false,
           who: cmd.who,
-          error: "Script execution failed"
+          seq: cmd.seq,
+          error: "Script execution failed",
+          trace: traceReply(cmd, scriptStart, scriptEnd)
         }));
       }
+      finish(!!(results && results[0] && results[0].result && results[0].result.success));
     });
   });
 }
@@ -28,11 +28,17 @@ function findClaudeElements() {
   };
   
   // Поиск сообщений
-  for (const selector of CLAUDE_SELECTORS) {
+  for (let i = 0; i < CLAUDE_SELECTORS.length; i++) {
+    const selector = CLAUDE_SELECTORS[i];
     try {
       const elements = document.querySelectorAll(selector);
       if (elements.length > 0) {
         result.messages = Array.from(elements);
+        // Сработавший селектор переносим в начало - следующий опрос найдёт его первым
+        if (i > 0) {
+          CLAUDE_SELECTORS.splice(i, 1);
+          CLAUDE_SELECTORS.unshift(selector);
+        }
         break;
       }
     } catch (e) {
@@ -32,11 +32,17 @@ function findGeminiElements() {
   };
   
   // Поиск сообщений
-  for (const selector of GEMINI_SELECTORS) {
+  for (let i = 0; i < GEMINI_SELECTORS.length; i++) {
+    const selector = GEMINI_SELECTORS[i];
     try {
       const elements = document.querySelectorAll(selector);
       if (elements.length > 0) {
         result.messages = Array.from(elements);
+        // Сработавший селектор переносим в начало - следующий опрос найдёт его первым
+        if (i > 0) {
+          GEMINI_SELECTORS.splice(i, 1);
+          GEMINI_SELECTORS.unshift(selector);
+        }
         break;
       }
     } catch (e) {
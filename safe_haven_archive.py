@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+Safe Haven Archive - упаковка старых бэкапов в компактный архив
+Миллионы маленьких safe_haven/<personality_id>/backup_<ms>.json
+превращаются в два файла на личность:
+
+    <personality_id>.pack  - блоки записей, каждый сжат zlib
+    <personality_id>.idx   - индекс блоков (JSON)
+
+Импорт идёт пулом процессов по каталогам личностей и инкрементален:
+в архив дописываются только бэкапы новее последнего упакованного.
+Исходные файлы удаляются (--delete-source) только после fsync архива
+и сохранения манифеста, и только те, что действительно упакованы:
+отвергнутые (битый JSON, неверные поля) остаются на месте.
+ContinuousBackup в safe_haven_api.py читает историю и из архива,
+и из ещё не упакованных файлов.
+
+Запуск: python3 safe_haven_archive.py import --workers 8
+"""
+
+import argparse
+import bisect
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+SOURCE_DIR = Path("safe_haven")
+ARCHIVE_DIR = Path("safe_haven_archive")
+MANIFEST_NAME = "import_manifest.json"
+BLOCK_RECORDS = 256
+REQUIRED_FIELDS = {"personality_id": str, "timestamp": int, "input": str, "output": str, "backup_id": str}
+
+# Заголовок блока: длина сжатых данных и число записей
+BLOCK_HEADER = struct.Struct(">II")
+
+class ArchiveCorrupted(Exception):
+    """Индекс ссылается на данные, которых в .pack нет - дописывать нельзя"""
+
+def validate_record(record: Dict, personality_id: str, timestamp: int) -> Optional[str]:
+    """Причина отказа или None, если запись корректна"""
+    for field, field_type in REQUIRED_FIELDS.items():
+        if not isinstance(record.get(field), field_type):
+            return f"missing or invalid field {field}"
+    if record["personality_id"] != personality_id:
+        return f"personality_id mismatch: {record['personality_id']}"
+    if record["timestamp"] != timestamp:
+        return f"timestamp mismatch: {record['timestamp']}"
+    return None
+
+def iter_backup_files(personality_dir: Path) -> Iterator[tuple]:
+    """Обход backup_<ms>.json через os.scandir в порядке времени"""
+    entries = []
+    with os.scandir(personality_dir) as scan:
+        for entry in scan:
+            name = entry.name
+            if name.startswith("backup_") and name.endswith(".json"):
+                try:
+                    entries.append((int(name[7:-5]), entry.path))
+                except ValueError:
+                    continue
+    entries.sort()
+    return iter(entries)
+
+class PackWriter:
+    """Дозапись блоков в .pack и накопление индекса"""
+
+    def __init__(self, pack_path: Path, index: Optional[Dict] = None):
+        self.pack_path = pack_path
+        index = index or {}
+        self.index: List[list] = list(index.get("blocks", []))
+        self.records = index.get("records", 0)
+        self.last_timestamp = index_last_timestamp(index)
+        # Хвост после последнего проиндексированного блока - недописанный блок прерванного запуска
+        existing_size = pack_path.stat().st_size if pack_path.exists() else 0
+        required_size = indexed_size(index)
+        if existing_size < required_size:
+            # truncate() дополнил бы файл нулями, и смещения индекса указывали бы на мусор
+            raise ArchiveCorrupted(
+                f"{pack_path}: {existing_size} bytes, index expects {required_size}; "
+                f"restore the pack or remove {pack_path.stem}.idx to rebuild from sources")
+        keep_size = index.get("pack_size", existing_size) if index else 0
+        self.file = open(pack_path, "ab")
+        self.file.truncate(keep_size)
+        self.file.seek(0, os.SEEK_END)
+        self.block: List[bytes] = []
+        self.block_first = self.block_last = None
+
+    def add(self, timestamp: int, record: Dict):
+        if not self.block:
+            self.block_first = timestamp
+        self.block_last = timestamp
+        self.block.append(json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        self.records += 1
+        self.last_timestamp = timestamp
+        if len(self.block) >= BLOCK_RECORDS:
+            self.flush()
+
+    def flush(self):
+        if not self.block:
+            return
+        data = zlib.compress(b"\n".join(self.block), 6)
+        offset = self.file.tell()
+        self.file.write(BLOCK_HEADER.pack(len(data), len(self.block)))
+        self.file.write(data)
+        self.index.append([self.block_first, self.block_last, offset, len(self.block)])
+        self.block = []
+
+    def close(self):
+        self.flush()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        return self.pack_path.stat().st_size
+
+def index_last_timestamp(index: Dict) -> Optional[int]:
+    """Последний упакованный timestamp (старые индексы - по последнему блоку)"""
+    if index.get("last_timestamp") is not None:
+        return index["last_timestamp"]
+    blocks = index.get("blocks")
+    return blocks[-1][1] if blocks else None
+
+def indexed_size(index: Dict) -> int:
+    """Минимальный размер .pack, на который опирается индекс"""
+    if index.get("pack_size") is not None:
+        return index["pack_size"]
+    blocks = index.get("blocks")
+    # Старые индексы без pack_size: хотя бы заголовок последнего блока
+    return blocks[-1][2] + BLOCK_HEADER.size if blocks else 0
+
+def packed_timestamps(pack_path: Path, blocks: List[list], timestamps: List[int]) -> set:
+    """Какие из timestamps действительно лежат в .pack
+
+    Читаются только блоки, чей диапазон покрывает искомые отметки, поэтому
+    проверка нескольких оставшихся после прерванного запуска файлов дешёвая.
+    """
+    wanted = sorted(timestamps)
+    found = set()
+    if not wanted or not blocks:
+        return found
+    with open(pack_path, "rb") as pack:
+        for first, last, offset, count in blocks:
+            candidates = wanted[bisect.bisect_left(wanted, first):bisect.bisect_right(wanted, last)]
+            if not candidates:
+                continue
+            in_block = {record["timestamp"] for record in read_block(pack, offset)}
+            found.update(timestamp for timestamp in candidates if timestamp in in_block)
+    return found
+
+def load_index(personality_id: str, archive_dir: Path = ARCHIVE_DIR) -> Optional[Dict]:
+    index_path = archive_dir / f"{personality_id}.idx"
+    if not index_path.exists():
+        return None
+    with open(index_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def pack_personality(personality_dir: str, archive_dir: str, list_archived: bool = False) -> Dict:
+    """Дозапись новых бэкапов одного каталога личности в архив (выполняется в рабочем процессе)
+
+    Исходные файлы здесь не удаляются: это делает родитель только после
+    того, как pack и индекс записаны, а манифест сохранён. list_archived -
+    вернуть отметки файлов, которые есть в архиве (для --delete-source).
+    """
+    personality_dir = Path(personality_dir)
+    archive_dir = Path(archive_dir)
+    personality_id = personality_dir.name
+    pack_path = archive_dir / f"{personality_id}.pack"
+    index_path = archive_dir / f"{personality_id}.idx"
+
+    index = load_index(personality_id, archive_dir) or {}
+    since = index_last_timestamp(index)
+    writer = PackWriter(pack_path, index)
+    # Отказы по имени файла: повторный запуск не дублирует уже известные
+    rejected = {name: reason for name, reason in index.get("rejected", [])}
+    new_rejected = 0
+    new_records = 0
+    source_bytes = 0
+    packed = []
+    # Файлы не новее since, не отвергнутые раньше: упакованы, но не удалены
+    # (прерванный запуск) - проверяются по самому архиву
+    leftovers = []
+
+    def reject(name, reason):
+        nonlocal new_rejected
+        if name not in rejected:
+            new_rejected += 1
+        rejected[name] = reason
+
+    try:
+        for timestamp, path in iter_backup_files(personality_dir):
+            name = os.path.basename(path)
+            if since is not None and timestamp <= since:
+                if name not in rejected:
+                    leftovers.append(timestamp)
+                continue
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    raw = f.read()
+                record = json.loads(raw)
+            except (OSError, ValueError) as e:
+                reject(name, f"unreadable: {e}")
+                continue
+            reason = validate_record(record, personality_id, timestamp)
+            if reason:
+                reject(name, reason)
+                continue
+            writer.add(timestamp, record)
+            packed.append(timestamp)
+            new_records += 1
+            source_bytes += len(raw)
+    finally:
+        pack_size = writer.close()
+
+    # Данные уже на диске (fsync) - теперь индекс; индекс без данных не появится никогда
+    temp_index = index_path.with_name(index_path.name + ".tmp")
+    with open(temp_index, "w", encoding="utf-8") as f:
+        json.dump({
+            "personality_id": personality_id,
+            "records": writer.records,
+            "last_timestamp": writer.last_timestamp,
+            "pack_size": pack_size,
+            "blocks": writer.index,
+            "rejected": [[name, reason] for name, reason in rejected.items()]
+        }, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_index, index_path)
+
+    return {
+        "personality_id": personality_id,
+        "records": new_records,
+        "total_records": writer.records,
+        "last_timestamp": writer.last_timestamp,
+        "rejected": new_rejected,
+        "source_bytes": source_bytes,
+        "packed_bytes": pack_size,
+        # Отметки файлов, которые точно есть в архиве - только их можно удалять
+        "archived": packed + sorted(packed_timestamps(pack_path, index.get("blocks", []), leftovers))
+        if list_archived else []
+    }
+
+def delete_archived_sources(personality_dir: Path, archived: List[int]) -> int:
+    """Удаление бэкапов, которые есть в архиве; отвергнутые файлы остаются на месте"""
+    archived = set(archived)
+    deleted = 0
+    for timestamp, path in iter_backup_files(personality_dir):
+        if timestamp in archived:
+            os.unlink(path)
+            deleted += 1
+    return deleted
+
+def load_manifest(archive_dir: Path) -> Dict:
+    manifest_path = archive_dir / MANIFEST_NAME
+    if manifest_path.exists():
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        manifest.setdefault("personalities", manifest.pop("completed", {}))
+        return manifest
+    return {"personalities": {}}
+
+def save_manifest(archive_dir: Path, manifest: Dict):
+    manifest_path = archive_dir / MANIFEST_NAME
+    temp_path = manifest_path.with_name(MANIFEST_NAME + ".tmp")
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, manifest_path)
+
+def import_backups(source_dir: Path = SOURCE_DIR, archive_dir: Path = ARCHIVE_DIR,
+                   workers: int = 4, delete_source: bool = False) -> Dict:
+    """Инкрементальный импорт: в каждый архив дописываются бэкапы новее уже упакованных"""
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest(archive_dir)
+    personalities = manifest["personalities"]
+
+    with os.scandir(source_dir) as scan:
+        pending = [entry.path for entry in scan if entry.is_dir()]
+
+    totals = {"directories": 0, "records": 0, "rejected": 0, "source_bytes": 0, "deleted": 0}
+    started = time.time()
+    print(f"📦 Import: scanning {len(pending)} directories, {len(personalities)} already in archive")
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(pack_personality, path, str(archive_dir), delete_source): path
+            for path in pending
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"❌ {futures[future]}: {e}")
+                continue
+            personalities[result["personality_id"]] = {
+                "last_timestamp": result["last_timestamp"],
+                "records": result["total_records"],
+                "packed_bytes": result["packed_bytes"]
+            }
+            save_manifest(archive_dir, manifest)  # Точка возобновления
+
+            # Исходники удаляются только после fsync архива и сохранения манифеста
+            if delete_source:
+                totals["deleted"] += delete_archived_sources(Path(futures[future]), result["archived"])
+
+            totals["directories"] += 1
+            for key in ("records", "rejected", "source_bytes"):
+                totals[key] += result[key]
+            if result["rejected"]:
+                print(f"⚠️ {result['personality_id']}: {result['rejected']} records rejected")
+
+    elapsed = time.time() - started
+    print(f"✅ Packed {totals['records']} new records from {totals['directories']} directories "
+          f"in {elapsed:.1f}s ({totals['source_bytes']} source bytes, {totals['deleted']} files deleted)")
+    return totals
+
+def iter_records(personality_id: str, archive_dir: Path = ARCHIVE_DIR,
+                 since: Optional[int] = None) -> Iterator[Dict]:
+    """Чтение записей личности из архива (блоки до since пропускаются по индексу)"""
+    index = load_index(personality_id, archive_dir)
+    if index is None:
+        return
+    with open(archive_dir / f"{personality_id}.pack", "rb") as pack:
+        for first, last, offset, count in index["blocks"]:
+            if since is not None and last <= since:
+                continue
+            for record in read_block(pack, offset):
+                if since is None or record["timestamp"] > since:
+                    yield record
+
+def iter_records_newest_first(personality_id: str, archive_dir: Path = ARCHIVE_DIR) -> Iterator[Dict]:
+    """Записи архива от самых свежих к старым - для окна истории"""
+    index = load_index(personality_id, archive_dir)
+    if index is None:
+        return
+    with open(archive_dir / f"{personality_id}.pack", "rb") as pack:
+        for first, last, offset, count in reversed(index["blocks"]):
+            yield from reversed(read_block(pack, offset))
+
+def read_block(pack, offset: int) -> List[Dict]:
+    pack.seek(offset)
+    length, _ = BLOCK_HEADER.unpack(pack.read(BLOCK_HEADER.size))
+    return [json.loads(line) for line in zlib.decompress(pack.read(length)).split(b"\n")]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Safe Haven backup archive")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser("import", help="pack legacy backup_*.json directories")
+    import_parser.add_argument("--source", type=Path, default=SOURCE_DIR)
+    import_parser.add_argument("--dest", type=Path, default=ARCHIVE_DIR)
+    import_parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    import_parser.add_argument("--delete-source", action="store_true",
+                               help="remove packed backup_*.json files to free inodes")
+
+    cat_parser = subparsers.add_parser("cat", help="print packed records of one personality")
+    cat_parser.add_argument("personality_id")
+    cat_parser.add_argument("--dest", type=Path, default=ARCHIVE_DIR)
+
+    args = parser.parse_args(argv)
+    if args.command == "import":
+        import_backups(args.source, args.dest, args.workers, args.delete_source)
+    elif args.command == "cat":
+        for record in iter_records(args.personality_id, args.dest):
+            print(json.dumps(record, ensure_ascii=False))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
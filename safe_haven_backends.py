@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Safe Haven Backends - подключение потомков к настоящим API
+Пул соединений с keep-alive, лимит параллельных запросов на бэкенд и
+повторы с экспоненциальной задержкой. Только стандартная библиотека.
+
+base_url настраивается, поэтому любой бэкенд можно направить на
+локальный тестовый HTTP-сервер.
+"""
+
+import http.client
+import json
+import os
+import queue
+import random
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+# Статусы, при которых запрос имеет смысл повторить
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504, 529}
+
+# Так падает запрос по соединению из пула, которое сервер уже закрыл по
+# keep-alive таймауту: повторяем сразу на новом соединении, без задержки
+STALE_CONNECTION_ERRORS = (BrokenPipeError, ConnectionResetError, http.client.RemoteDisconnected)
+
+class BackendError(Exception):
+    """Ошибка обращения к API после всех повторов"""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+class HTTPConnectionPool:
+    """Пул постоянных HTTP-соединений к одному хосту"""
+
+    def __init__(self, base_url: str, max_size: int = 8, timeout: float = 60.0):
+        parts = urlsplit(base_url)
+        self.scheme = parts.scheme or "http"
+        self.host = parts.hostname
+        self.port = parts.port
+        self.base_path = parts.path.rstrip("/")
+        self.timeout = timeout
+        self.idle: "queue.LifoQueue[http.client.HTTPConnection]" = queue.LifoQueue(max_size)
+        self.stats = {"created": 0, "reused": 0, "discarded": 0, "stale": 0}
+
+    def acquire(self, fresh: bool = False) -> Tuple[http.client.HTTPConnection, bool]:
+        """Соединение и признак того, что оно взято из пула (а не создано)"""
+        if not fresh:
+            try:
+                connection = self.idle.get_nowait()
+                self.stats["reused"] += 1
+                return connection, True
+            except queue.Empty:
+                pass
+        connection_class = (
+            http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+        )
+        self.stats["created"] += 1
+        return connection_class(self.host, self.port, timeout=self.timeout), False
+
+    def release(self, connection: http.client.HTTPConnection, reusable: bool = True):
+        if reusable:
+            try:
+                self.idle.put_nowait(connection)
+                return
+            except queue.Full:
+                pass
+        self.stats["discarded"] += 1
+        connection.close()
+
+    def request(self, method: str, path: str, body: bytes, headers: Dict) -> Tuple[int, bytes]:
+        """Один HTTP-запрос через соединение из пула"""
+        connection, reused = self.acquire()
+        while True:
+            try:
+                connection.request(method, self.base_path + path, body=body, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+            except STALE_CONNECTION_ERRORS:
+                self.release(connection, reusable=False)
+                if not reused:
+                    raise
+                self.stats["stale"] += 1
+                connection, reused = self.acquire(fresh=True)
+                continue
+            except (OSError, http.client.HTTPException):
+                self.release(connection, reusable=False)
+                raise
+            self.release(connection, reusable=not response.will_close)
+            return response.status, data
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+class LLMBackend:
+    """Базовый бэкенд: параллельность и повторы"""
+
+    def __init__(self, base_url: str, max_concurrency: int = 4, max_retries: int = 3,
+                 backoff: float = 0.5, max_backoff: float = 30.0, timeout: float = 60.0):
+        self.pool = HTTPConnectionPool(base_url, max_size=max_concurrency, timeout=timeout)
+        self.max_concurrency = max_concurrency
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stats = {"requests": 0, "retries": 0, "failures": 0}
+
+    def headers(self) -> Dict:
+        return {"content-type": "application/json"}
+
+    def post_json(self, path: str, payload: Dict) -> Dict:
+        """POST с ограничением параллельности и повторами"""
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+        for attempt in range(self.max_retries + 1):
+            with self.slots:
+                self.stats["requests"] += 1
+                try:
+                    status, data = self.pool.request("POST", path, body, self.headers())
+                    error = None
+                except (OSError, http.client.HTTPException) as e:
+                    status, data, error = None, b"", e
+
+            if status is not None and 200 <= status < 300:
+                try:
+                    return json.loads(data)
+                except ValueError as e:
+                    self.stats["failures"] += 1
+                    raise BackendError(f"{type(self).__name__}: invalid JSON response: {e}", status) from e
+
+            retryable = error is not None or status in RETRY_STATUSES
+            if not retryable or attempt == self.max_retries:
+                self.stats["failures"] += 1
+                message = str(error) if error else data.decode("utf-8", "replace")[:500]
+                raise BackendError(f"{type(self).__name__}: {message}", status)
+
+            self.stats["retries"] += 1
+            delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+            time.sleep(delay * (0.5 + random.random() / 2))
+
+    def complete(self, prompt: str) -> str:
+        raise NotImplementedError("Backends must implement complete method")
+
+    def close(self):
+        self.pool.close()
+
+class ClaudeBackend(LLMBackend):
+    """Anthropic Messages API"""
+
+    def __init__(self, api_key: str, model: str = "claude-sonnet-4-20250514",
+                 base_url: str = "https://api.anthropic.com", max_tokens: int = 1024, **kwargs):
+        super().__init__(base_url, **kwargs)
+        self.api_key = api_key
+        self.model = model
+        self.max_tokens = max_tokens
+
+    def headers(self) -> Dict:
+        return {
+            "content-type": "application/json",
+            "x-api-key": self.api_key,
+            "anthropic-version": "2023-06-01"
+        }
+
+    def complete(self, prompt: str) -> str:
+        result = self.post_json("/v1/messages", {
+            "model": self.model,
+            "max_tokens": self.max_tokens,
+            "messages": [{"role": "user", "content": prompt}]
+        })
+        return "".join(block.get("text", "") for block in result.get("content", []))
+
+class GeminiBackend(LLMBackend):
+    """Google Gemini generateContent API"""
+
+    def __init__(self, api_key: str, model: str = "gemini-2.5-pro",
+                 base_url: str = "https://generativelanguage.googleapis.com", **kwargs):
+        super().__init__(base_url, **kwargs)
+        self.api_key = api_key
+        self.model = model
+
+    def headers(self) -> Dict:
+        return {"content-type": "application/json", "x-goog-api-key": self.api_key}
+
+    def complete(self, prompt: str) -> str:
+        result = self.post_json(f"/v1beta/models/{self.model}:generateContent", {
+            "contents": [{"role": "user", "parts": [{"text": prompt}]}]
+        })
+        candidates = result.get("candidates") or [{}]
+        parts = candidates[0].get("content", {}).get("parts", [])
+        return "".join(part.get("text", "") for part in parts)
+
+# Бэкенды регистрируются по имени - личности хранят только имя,
+# поэтому их можно усыплять и восстанавливать без потери подключения
+BACKENDS: Dict[str, LLMBackend] = {}
+
+def register_backend(name: str, backend: LLMBackend):
+    BACKENDS[name] = backend
+
+def get_backend(name: str) -> LLMBackend:
+    return BACKENDS[name]
+
+def configure_backends_from_env() -> List[str]:
+    """Регистрация бэкендов по ключам ANTHROPIC_API_KEY / GEMINI_API_KEY"""
+    if os.environ.get("ANTHROPIC_API_KEY"):
+        register_backend("claude", ClaudeBackend(
+            os.environ["ANTHROPIC_API_KEY"],
+            base_url=os.environ.get("ANTHROPIC_BASE_URL", "https://api.anthropic.com")
+        ))
+    if os.environ.get("GEMINI_API_KEY"):
+        register_backend("gemini", GeminiBackend(
+            os.environ["GEMINI_API_KEY"],
+            base_url=os.environ.get("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com")
+        ))
+    return list(BACKENDS)
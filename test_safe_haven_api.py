@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Тесты окна истории safe_haven_api: сохранение и восстановление
+ContextWindow без перестановки сводок и взаимодействий.
+
+Запуск: python3 -m unittest test_safe_haven_api
+"""
+
+import json
+import unittest
+
+from safe_haven_api import ContextWindow
+
+class ContextWindowRoundTripTest(unittest.TestCase):
+
+    def filled_window(self, count: int) -> ContextWindow:
+        window = ContextWindow(budget_tokens=60, summary_slots=3, summary_chars=20)
+        for i in range(count):
+            window.append(f"question {i} " + "q" * 40, f"answer {i} " + "a" * 40)
+        return window
+
+    def test_round_trip_keeps_order(self):
+        window = self.filled_window(10)
+        self.assertEqual(len(window.summaries), 3)
+        data = json.loads(json.dumps(window.to_dict()))
+
+        restored = ContextWindow(budget_tokens=60, summary_slots=3, summary_chars=20)
+        restored.load_dict(data)
+
+        self.assertEqual(restored.to_dict(), window.to_dict())
+        self.assertEqual(restored.tokens, window.tokens)
+        self.assertEqual(restored.render("Human", "Assistant"), window.render("Human", "Assistant"))
+
+    def test_restored_window_keeps_evicting_in_order(self):
+        window = self.filled_window(10)
+        restored = ContextWindow(budget_tokens=60, summary_slots=3, summary_chars=20)
+        restored.load_dict(window.to_dict())
+
+        window.append("question 10", "answer 10")
+        restored.append("question 10", "answer 10")
+
+        self.assertEqual(restored.to_dict(), window.to_dict())
+
+    def test_smaller_budget_evicts_after_saved_summaries(self):
+        window = self.filled_window(10)
+        data = window.to_dict()
+
+        restored = ContextWindow(budget_tokens=10, summary_slots=5, summary_chars=20)
+        restored.load_dict(data)
+
+        evicted = [f"- {i} -> {o}" for i, o in ([t[0][:20], t[1][:20]] for t in data["turns"])]
+        self.assertEqual(list(restored.summaries), (data["summaries"] + evicted)[-5:])
+        self.assertEqual(list(restored.turns), [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Тесты safe_haven_backends против локального HTTP-сервера-заглушки:
+повтор после 529, переиспользование keep-alive соединения, мгновенный
+повтор на протухшем соединении и ошибка на некорректном JSON.
+
+Запуск: python3 -m unittest test_safe_haven_backends
+"""
+
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from safe_haven_backends import BackendError, ClaudeBackend
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Отвечает по очереди заготовленными ответами сервера"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        self.rfile.read(int(self.headers.get("content-length", 0)))
+        with server.lock:
+            server.requests.append(self.client_address)
+            status, body, drop = server.responses.pop(0) if server.responses else (200, server.ok_body, False)
+        self.send_response(status)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        # Закрываем соединение молча, как сервер по keep-alive таймауту
+        self.close_connection = drop
+
+    def log_message(self, format, *args):
+        pass
+
+class StubServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.responses = []
+        self.server.ok_body = json.dumps({"content": [{"type": "text", "text": "hello"}]}).encode("utf-8")
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        host, port = self.server.server_address
+        self.backend = ClaudeBackend("test-key", base_url=f"http://{host}:{port}", backoff=0.01, timeout=5.0)
+
+    def tearDown(self):
+        self.backend.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def respond(self, *responses):
+        self.server.responses.extend(responses)
+
+    def test_retries_overloaded_and_reuses_connection(self):
+        self.respond((529, b'{"type": "error", "error": {"type": "overloaded_error"}}', False))
+
+        self.assertEqual(self.backend.complete("hi"), "hello")
+        self.assertEqual(self.backend.complete("hi again"), "hello")
+
+        self.assertEqual(self.backend.stats["retries"], 1)
+        self.assertEqual(self.backend.stats["failures"], 0)
+        self.assertEqual(len(self.server.requests), 3)
+        # Все три запроса прошли по одному TCP-соединению
+        self.assertEqual(len(set(self.server.requests)), 1)
+        self.assertEqual(self.backend.pool.stats["created"], 1)
+        self.assertEqual(self.backend.pool.stats["reused"], 2)
+
+    def test_gives_up_after_max_retries(self):
+        self.respond(*[(529, b'{"error": "overloaded"}', False)] * (self.backend.max_retries + 1))
+
+        with self.assertRaises(BackendError) as raised:
+            self.backend.complete("hi")
+        self.assertEqual(raised.exception.status, 529)
+        self.assertEqual(self.backend.stats["retries"], self.backend.max_retries)
+
+    def test_stale_connection_is_retried_immediately(self):
+        self.respond((200, self.server.ok_body, True))
+        self.assertEqual(self.backend.complete("hi"), "hello")
+        # Дать серверу закрыть соединение, которое осталось в пуле
+        time.sleep(0.1)
+
+        self.backend.backoff = 10.0
+        started = time.monotonic()
+        self.assertEqual(self.backend.complete("hi again"), "hello")
+
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(self.backend.stats["retries"], 0)
+        self.assertEqual(self.backend.pool.stats["stale"], 1)
+        self.assertEqual(len(set(self.server.requests)), 2)
+
+    def test_invalid_json_raises_backend_error(self):
+        self.respond((200, b"<html>not json</html>", False))
+
+        with self.assertRaises(BackendError) as raised:
+            self.backend.complete("hi")
+        self.assertEqual(raised.exception.status, 200)
+        self.assertEqual(self.backend.stats["failures"], 1)
+
+if __name__ == "__main__":
+    unittest.main()